@@ -0,0 +1,147 @@
+"""
+Admission control for the Flask service.
+
+Each request holds full-resolution decoded arrays while it runs, so a
+burst of large uploads can exhaust an instance's RAM. Every worker keeps
+a budget of decoded megapixels in flight (queued background jobs hold
+their share until they finish) and turns requests beyond it away with
+429 and Retry-After instead of letting everyone slow down together.
+gunicorn.conf.py runs threaded workers, so the budget covers the requests
+a worker serves concurrently as well as its queued jobs.
+
+Part of the budget is reserved for a priority lane: small validation
+requests may use all of it, everything else only what is left above the
+reserve, so big compiles cannot starve quick checks. A request that is
+larger than the whole budget is still admitted when nothing else is in
+flight (upload limits already bound its size).
+"""
+
+import os
+import threading
+
+from image_io import reduced_decode_scale
+
+# Rough decoded pixels per upload byte when the header gave no dimensions
+UNKNOWN_PIXELS_PER_BYTE = 4
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request does not fit the worker's budget; carries the Retry-After seconds
+    """
+
+    def __init__(self, message, retry_after=2):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def decoded_megapixels(header, target_size, data_size=0):
+    """
+    Megapixels decode_image_reduced will hold for an upload with this header
+    JPEGs decode at a reduced scale; other formats decode at full size first
+    """
+    if header is None:
+        return data_size * UNKNOWN_PIXELS_PER_BYTE / 1e6
+
+    image_format, width, height = header
+    scale = reduced_decode_scale(width, height, target_size) if image_format == 'jpeg' else 1
+    return (width // scale) * (height // scale) / 1e6
+
+
+class Reservation:
+    """
+    Megapixels held against an AdmissionController until released (idempotent)
+    """
+
+    def __init__(self, controller, megapixels, kind):
+        self._controller = controller
+        self.megapixels = megapixels
+        self.kind = kind
+        self._released = False
+
+    def release(self, *_):
+        # Extra arguments let this be used directly as a future done callback
+        self._controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Per-worker budget of in-flight decoded megapixels with a priority lane
+    """
+
+    def __init__(self, max_megapixels=64, priority_megapixels=8, small_megapixels=4, retry_after=2):
+        self.max_megapixels = max_megapixels
+        self.priority_megapixels = min(priority_megapixels, max_megapixels)
+        self.small_megapixels = small_megapixels
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._in_flight = 0.0
+        self._held = {'request': 0, 'job': 0}
+        self._counters = {'admitted': 0, 'priorityAdmitted': 0, 'rejected': 0, 'priorityRejected': 0}
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a controller configured from MINDAR_ADMISSION_* environment variables
+        """
+        return cls(
+            max_megapixels=float(os.environ.get('MINDAR_ADMISSION_MAX_MEGAPIXELS', 64)),
+            priority_megapixels=float(os.environ.get('MINDAR_ADMISSION_PRIORITY_MEGAPIXELS', 8)),
+            small_megapixels=float(os.environ.get('MINDAR_ADMISSION_SMALL_MEGAPIXELS', 4)),
+            retry_after=int(os.environ.get('MINDAR_ADMISSION_RETRY_AFTER', 2)),
+        )
+
+    def acquire(self, megapixels, priority=False, kind='request'):
+        """
+        Reserve megapixels for a request (or a queued job) and return the Reservation
+
+        priority requests use the reserved lane if they are small enough.
+        Raises Overloaded when the reservation does not fit.
+        """
+        priority = priority and megapixels <= self.small_megapixels
+        limit = self.max_megapixels if priority else self.max_megapixels - self.priority_megapixels
+
+        with self._lock:
+            if self._in_flight > 0 and self._in_flight + megapixels > limit:
+                self._counters['priorityRejected' if priority else 'rejected'] += 1
+                raise Overloaded(
+                    f"Server busy ({self._in_flight:.1f} of {limit:g} MP in flight, "
+                    f"request needs {megapixels:.1f} MP)", self.retry_after)
+
+            self._in_flight += megapixels
+            self._held[kind] += 1
+            self._counters['priorityAdmitted' if priority else 'admitted'] += 1
+
+        return Reservation(self, megapixels, kind)
+
+    def _release(self, reservation):
+        with self._lock:
+            if reservation._released:
+                return
+            reservation._released = True
+            self._held[reservation.kind] -= 1
+            # Clamp float drift so an idle worker reports exactly zero
+            self._in_flight = max(self._in_flight - reservation.megapixels, 0.0) if any(self._held.values()) else 0.0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update(
+                inFlightMegapixels=round(self._in_flight, 3),
+                inFlightRequests=self._held['request'],
+                queuedJobs=self._held['job'],
+            )
+        stats.update(
+            maxMegapixels=self.max_megapixels,
+            priorityMegapixels=self.priority_megapixels,
+            smallMegapixels=self.small_megapixels,
+            retryAfter=self.retry_after,
+        )
+        return stats
@@ -1,207 +1,828 @@
+import time
+
+# Measured from the start of the import so cold starts include library loading
+IMPORT_STARTED = time.time()
+
 from flask import Flask, request, send_file, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from concurrent.futures.process import BrokenProcessPool
 import cv2
 import numpy as np
-import io
-import tempfile
+import json
+import base64
 import os
-from PIL import Image
+import threading
+
+import buffer_pool
+import metrics
+from admission import AdmissionController, Overloaded, decoded_megapixels
+from compile_cache import CompileCache, cache_key
+from descriptor_index import DescriptorIndex, select_descriptors
+from detectors import DEFAULT_DETECTOR as ORB_DETECTOR, available_detectors
+from http_cache import HttpCache, available_encodings, content_digest
+from job_queue import JobManager, QueueFullError
+from target_compiler import (CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, MAX_IMAGE_SIZE, ORB_FEATURES, VALIDATION_MAX_SIZE,
+                             build_mind_image_entry, compile_options, compile_target, extract_features,
+                             instrument, process_image, serialize_mind_data, validate_target)
+from uploads import UploadLimits, UploadRejected, read_image_upload
+from video_prep import available_video_formats, iter_file_chunks, prepare_video, probe_video, spool_upload
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Validation-Report', 'Retry-After', 'Server-Timing', 'ETag'])
+
+# Compile parameters (also part of the compile cache key); the pipeline
+# itself and its fixed settings live in target_compiler
+# Bump PIPELINE_VERSION whenever a change alters the generated .mind bytes
+PIPELINE_VERSION = 5
+# Features kept per target out of the ORB_FEATURES detected (?features=N per request)
+FEATURE_BUDGET = int(os.environ.get('MINDAR_FEATURE_BUDGET', 500))
+
+# Output encoding of /generate-mind style files: legacy 'json', which existing
+# clients parse, or the compact 'binary' feature_format (opt in with
+# ?output=binary or MINDAR_MIND_FORMAT=binary)
+DEFAULT_MIND_FORMAT = os.environ.get('MINDAR_MIND_FORMAT', 'json')
+DEFAULT_COMPRESSION = os.environ.get('MINDAR_MIND_COMPRESSION', 'none')
+
+# Preprocessing for feature extraction: 'gray' enhances a single grayscale
+# channel; 'color' runs CLAHE in LAB and sharpens all three channels. Basic
+# .mind files only store features, so the color work is only needed where a
+# color image is embedded (the CLI's create_mindar_file).
+DEFAULT_PREPROCESS = os.environ.get('MINDAR_PREPROCESS', 'gray')
+
+# Feature detector engine (see detectors): 'fast' for previews, 'orb', or
+# 'akaze' for final builds. Per request with ?detector=
+DEFAULT_DETECTOR = os.environ.get('MINDAR_DETECTOR', ORB_DETECTOR)
+
+# Overlay video preparation (/prepare-video): longest side, frame rate cap,
+# upload limit and output container (webm: VP8, mp4: H.264 where available)
+VIDEO_MAX_SIZE = int(os.environ.get('MINDAR_VIDEO_MAX_SIZE', 720))
+VIDEO_MAX_FPS = float(os.environ.get('MINDAR_VIDEO_MAX_FPS', 30))
+VIDEO_MAX_BYTES = int(float(os.environ.get('MINDAR_VIDEO_MAX_MB', 200)) * 1024 * 1024)
+DEFAULT_VIDEO_FORMAT = os.environ.get('MINDAR_VIDEO_FORMAT', 'webm')
+
+compile_cache = CompileCache.from_env()
+# Compressed response variants live in the compile cache next to the files
+http_cache = HttpCache.from_env(store=compile_cache)
+job_manager = JobManager.from_env()
+upload_limits = UploadLimits.from_env()
+# Caps every request body; the multipart batch endpoint is the one that
+# buffers whole bodies (single uploads and videos apply their own limits)
+app.config['MAX_CONTENT_LENGTH'] = upload_limits.max_batch_bytes
+app.config['MAX_FORM_PARTS'] = upload_limits.max_batch_images + 8
+admission = AdmissionController.from_env()
+descriptor_index = DescriptorIndex.from_env()
+# Pipeline stage timings feed /metrics and Server-Timing
+instrument(metrics.stage, metrics.observe)
+
+# Cold start bookkeeping for /ready and /health (per worker)
+startup = {
+    'importSeconds': None,
+    'prewarmSeconds': None,
+    'firstCompileSeconds': None,
+    'ready': False,
+}
+_prewarm_lock = threading.Lock()
 
-def process_image_for_mindar(image_data):
+# mindar_errors_total reasons by response status
+ERROR_REASONS = {
+    400: 'bad_request',
+    404: 'not_found',
+    409: 'conflict',
+    413: 'upload_too_large',
+    415: 'unsupported_media_type',
+    422: 'invalid_image',
+    429: 'overloaded',
+}
+
+def compile_params(mind_format=None, compression=None, preprocess=None, feature_budget=None, detector=None):
+    """
+    Parameters that affect the generated .mind file
+    """
+    compression = compression or DEFAULT_COMPRESSION
+    # Only binary output can be compressed, so asking for compression opts in to it
+    params = compile_options(
+        mind_format=mind_format or ('binary' if compression != 'none' else DEFAULT_MIND_FORMAT),
+        compression=compression,
+        preprocess=preprocess or DEFAULT_PREPROCESS,
+        feature_budget=feature_budget or FEATURE_BUDGET,
+        detector=detector or DEFAULT_DETECTOR,
+    )
+    return dict(params, pipeline_version=PIPELINE_VERSION)
+
+def request_compile_params():
+    """
+    Compile parameters for the current request
+    (?output=binary|json, ?compression=none|zlib|zstd, ?preprocess=gray|color, ?features=N,
+    ?detector=fast|orb|akaze)
+    """
+    return compile_params(request.args.get('output'), request.args.get('compression'),
+                          request.args.get('preprocess'), request.args.get('features'),
+                          request.args.get('detector'))
+
+def read_request_image():
+    """
+    Stream the raw request body, sniffing format and dimensions from the first KB
+    Returns (image_data, header); raises UploadRejected
+    """
+    request.max_content_length = upload_limits.max_bytes
+    try:
+        return read_image_upload(request.stream, request.content_length, upload_limits)
+    except RequestEntityTooLarge:
+        raise UploadRejected(f"Upload too large (limit {upload_limits.max_bytes} bytes)", 413)
+
+def admit_image(header, image_data, target_size=MAX_IMAGE_SIZE, priority=False):
+    """
+    Reserve the upload's decoded megapixels against this worker's admission budget
+    Use as a context manager around the decode; raises Overloaded
+    """
+    return admission.acquire(decoded_megapixels(header, target_size, len(image_data)), priority=priority)
+
+def overloaded_response(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+def mind_file_response(mind_file_data, download_name):
+    """
+    .mind file download with a strong ETag (304 on a matching If-None-Match)
+    and gzip/brotli transport encoding when accepted (see http_cache)
+    The body is handed to the WSGI server as is, without BytesIO copies
+    """
+    digest = content_digest(mind_file_data)
+    encoding = request.accept_encodings.best_match(available_encodings(), default='identity')
+    body, encoding = http_cache.variant(mind_file_data, digest, encoding)
+    etag = http_cache.etag(digest, encoding)
+    
+    response = app.response_class(mimetype='application/octet-stream')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if http_cache.max_age:
+        response.cache_control.max_age = http_cache.max_age
+    else:
+        response.cache_control.no_cache = True
+    
+    if request.if_none_match.contains_weak(etag):
+        http_cache.not_modified()
+        response.status_code = 304
+        return response
+    
+    response.headers.set('Content-Disposition', 'attachment', filename=download_name)
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    response.set_data(body)
+    return response
+
+def process_image_for_mindar(image_data, max_size=MAX_IMAGE_SIZE,
+                             clahe_clip_limit=CLAHE_CLIP_LIMIT, clahe_tile_grid=CLAHE_TILE_GRID,
+                             preprocess='color'):
     """
     Process image to be optimal for MindAR tracking
+    preprocess='gray' decodes and enhances a single channel and returns a grayscale image
     """
     try:
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise ValueError("Could not decode image")
-        
-        # Resize to optimal dimensions (power of 2, max 512x512 for performance)
-        height, width = img.shape[:2]
-        max_size = 512
-        
-        if max(height, width) > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
-        
-        # Enhance contrast and sharpness
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        
-        img = cv2.merge([l, a, b])
-        img = cv2.cvtColor(img, cv2.COLOR_LAB2BGR)
-        
-        # Sharpen the image
-        kernel = np.array([[-1,-1,-1],
-                          [-1, 9,-1],
-                          [-1,-1,-1]])
-        img = cv2.filter2D(img, -1, kernel)
-        
-        return img
-        
+        return process_image(image_data, {'max_size': max_size, 'clahe_clip_limit': clahe_clip_limit,
+                                           'clahe_tile_grid': clahe_tile_grid, 'preprocess': preprocess})
     except Exception as e:
         print(f"Image processing error: {e}")
         return None
 
-def create_basic_mind_file(processed_image):
+def create_basic_mind_file(processed_image, nfeatures=ORB_FEATURES, features=None,
+                           mind_format=DEFAULT_MIND_FORMAT, compression=DEFAULT_COMPRESSION,
+                           feature_budget=FEATURE_BUDGET, detector=DEFAULT_DETECTOR):
     """
     Create a basic .mind file structure
     This is a simplified version - in production you'd use the full MindAR compiler
+    Pass features=(gray, keypoints, descriptors) to reuse an earlier extraction
     """
     try:
-        # Convert to grayscale for feature detection
-        gray = cv2.cvtColor(processed_image, cv2.COLOR_BGR2GRAY)
-        
-        # Detect ORB features (similar to what MindAR uses)
-        orb = cv2.ORB_create(nfeatures=1000)
-        keypoints, descriptors = orb.detectAndCompute(gray, None)
+        gray, keypoints, descriptors = features or extract_features(processed_image, nfeatures, detector)
         
         if descriptors is None or len(keypoints) < 50:
             raise ValueError("Not enough features detected - image may not be suitable for AR tracking")
         
-        # Create a basic mind file structure
-        # Note: This is a simplified version. The real MindAR compiler creates a more complex structure
-        height, width = gray.shape
-        
-        mind_data = {
-            'images': [{
-                'width': width,
-                'height': height,
-                'keypoints': [[kp.pt[0], kp.pt[1], kp.angle, kp.response] for kp in keypoints[:500]],
-                'descriptors': descriptors[:500].tolist() if descriptors is not None else []
-            }],
-            'trackingData': {
-                'imageSize': [width, height],
-                'featureCount': min(len(keypoints), 500)
-            }
-        }
-        
-        # Convert to binary format (simplified)
-        import json
-        mind_json = json.dumps(mind_data)
-        return mind_json.encode('utf-8')
+        entry = build_mind_image_entry(gray, keypoints, descriptors, feature_budget, detector)
+        return serialize_mind_data([entry], mind_format, compression)
         
     except Exception as e:
         print(f"Mind file creation error: {e}")
         return None
 
+def compile_target_entry(image_data, params):
+    """
+    Validate one target and build its .mind entry from one decode and one feature extraction
+    Returns (validation_report, image_entry); image_entry is None when invalid
+    """
+    report, result = _compile(image_data, dict(params, mind_format=None))
+    return report, result['entry'] if result else None
+
+def compile_single_pass(image_data, params):
+    """
+    Validate and build a single-target .mind file in one pass
+    Returns (validation_report, mind_file_data); mind_file_data is None when invalid
+    """
+    report, result = _compile(image_data, params)
+    return report, result['payload'] if result else None
+
+def _compile(image_data, params):
+    # compile_target with failures turned into an invalid report; returns (report, result or None)
+    try:
+        result = compile_target(image_data, params)
+    except Exception as e:
+        return {'valid': False, 'reason': str(e), 'issues': [str(e)]}, None
+    return result['validation'], result
+
 @app.route('/generate-mind', methods=['POST'])
 def generate_mind():
     try:
-        # Get image data from request
-        image_data = request.get_data()
+        # Stream image data from request, rejecting non-images and bad sizes early
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
         filename = request.headers.get('X-Filename', 'marker.jpg')
         
-        if not image_data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
         print(f"Processing image: {filename}, size: {len(image_data)} bytes")
         
-        # Process the image
-        processed_image = process_image_for_mindar(image_data)
-        if processed_image is None:
-            return jsonify({'error': 'Failed to process image'}), 400
-        
-        # Create mind file
-        mind_file_data = create_basic_mind_file(processed_image)
-        if mind_file_data is None:
-            return jsonify({'error': 'Failed to create mind file'}), 400
+        try:
+            params = request_compile_params()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        key = cache_key(image_data, params)
+        mind_file_data = compile_cache.get(key)
+        
+        if mind_file_data is not None:
+            print(f"Compile cache hit: {key[:12]}")
+        else:
+            # Any image with enough features gets a file; /compile also enforces the validation criteria
+            with admit_image(header, image_data, params['max_size']):
+                try:
+                    result = compile_target(image_data, params, require_valid=False)
+                except Exception as e:
+                    print(f"Image processing error: {e}")
+                    return jsonify({'error': 'Failed to process image'}), 400
+            
+            mind_file_data = result['payload']
+            if mind_file_data is None:
+                print(f"Mind file creation error: {result['validation']['issues']}")
+                return jsonify({'error': 'Failed to create mind file'}), 400
+            
+            compile_cache.put(key, mind_file_data)
+            print(f"Mind file created successfully, size: {len(mind_file_data)} bytes")
         
-        print(f"Mind file created successfully, size: {len(mind_file_data)} bytes")
+        record_compile_success()
+        metrics.observe('mindar_output_bytes', len(mind_file_data))
         
         # Return the mind file
-        return send_file(
-            io.BytesIO(mind_file_data),
-            mimetype='application/octet-stream',
-            as_attachment=True,
-            download_name=filename.replace('.jpg', '.mind').replace('.png', '.mind')
-        )
+        return mind_file_response(mind_file_data, filename.replace('.jpg', '.mind').replace('.png', '.mind'))
         
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Error generating mind file: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
-        'status': 'healthy',
-        'service': 'mindar-compiler',
-        'version': '1.0.0'
-    })
-
-@app.route('/validate-image', methods=['POST'])
-def validate_image():
+@app.route('/compile', methods=['POST'])
+def compile_marker():
     """
-    Validate if an image is suitable for AR tracking
+    Validate an image and build its .mind file in a single pass
+    Returns JSON with the validation report and the base64 .mind payload,
+    or the raw .mind file with the report in X-Validation-Report when ?format=binary
     """
     try:
-        image_data = request.get_data()
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        filename = request.headers.get('X-Filename', 'marker.jpg')
+        
+        print(f"Compiling image: {filename}, size: {len(image_data)} bytes")
+        
+        try:
+            params = request_compile_params()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        mind_key = cache_key(image_data, params)
+        report_key = cache_key(image_data, dict(params, output='validation-report'))
+        
+        cached_report = compile_cache.get(report_key)
+        if cached_report is not None:
+            report = json.loads(cached_report)
+            mind_file_data = compile_cache.get(mind_key) if report['valid'] else None
+        
+        if cached_report is None or (report['valid'] and mind_file_data is None):
+            with admit_image(header, image_data, params['max_size']):
+                report, mind_file_data = compile_single_pass(image_data, params)
+            if report['valid'] and mind_file_data is None:
+                return jsonify({'error': 'Failed to create mind file', 'validation': report}), 400
+            
+            compile_cache.put(report_key, json.dumps(report).encode('utf-8'))
+            if mind_file_data is not None:
+                compile_cache.put(mind_key, mind_file_data)
         
-        # Process image
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if not report['valid']:
+            return jsonify({'validation': report, 'mind': None}), 422
         
-        if img is None:
-            return jsonify({'valid': False, 'reason': 'Could not decode image'})
+        record_compile_success()
+        metrics.observe('mindar_output_bytes', len(mind_file_data))
+        download_name = filename.replace('.jpg', '.mind').replace('.png', '.mind')
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if request.args.get('format') == 'binary':
+            response = mind_file_response(mind_file_data, download_name)
+            response.headers['X-Validation-Report'] = json.dumps(report)
+            return response
         
-        # Detect features
-        orb = cv2.ORB_create(nfeatures=1000)
-        keypoints, descriptors = orb.detectAndCompute(gray, None)
+        return jsonify({
+            'validation': report,
+            'mind': base64.b64encode(mind_file_data).decode('ascii'),
+            'mindSize': len(mind_file_data),
+            'filename': download_name
+        })
+        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ValueError as e:
+        return jsonify({'validation': {'valid': False, 'reason': str(e)}, 'mind': None}), 422
+    except Exception as e:
+        print(f"Error compiling marker: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def marker_descriptors(image_data, params):
+    """
+    Index descriptors of a marker image (the strongest of those its .mind file holds)
+    The index only holds ORB descriptors; other engines' descriptors do not match them
+    Returns (validation_report, descriptors); descriptors is None when invalid
+    """
+    report, entry = compile_target_entry(image_data, params)
+    if entry is None:
+        return report, None
+    
+    return report, select_descriptors(entry['descriptors'], entry['keypoints'][:, 3])
+
+@app.route('/markers', methods=['POST'])
+def add_marker():
+    """
+    Add a marker image to the similarity index under ?id=
+    Responds with the existing markers most similar to it (before adding)
+    """
+    try:
+        marker_id = request.args.get('id')
+        if not marker_id:
+            return jsonify({'error': 'Missing marker id (?id=)'}), 400
+        
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        
+        with admit_image(header, image_data):
+            report, descriptors = marker_descriptors(image_data, compile_params(detector=ORB_DETECTOR))
+        if descriptors is None:
+            return jsonify({'validation': report, 'error': 'Marker is not suitable for AR tracking'}), 422
+        
+        with metrics.stage('index'):
+            similar = descriptor_index.query(descriptors, request.args.get('limit', 5, type=int), exclude_id=marker_id)
+            info = {'filename': request.headers['X-Filename']} if 'X-Filename' in request.headers else None
+            descriptor_index.add(marker_id, descriptors, info)
+        descriptor_index.compact_in_background()
+        
+        return jsonify({'id': marker_id, 'descriptors': len(descriptors), 'similar': similar}), 201
+        
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error indexing marker: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/markers/similar', methods=['POST'])
+def similar_markers():
+    """
+    Most similar indexed markers to an uploaded image (?limit=5, ?exclude=<id>)
+    score is the fraction of the image's descriptors that match the marker
+    """
+    try:
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
         
-        feature_count = len(keypoints) if keypoints else 0
+        with admit_image(header, image_data):
+            report, descriptors = marker_descriptors(image_data, compile_params(detector=ORB_DETECTOR))
+        if descriptors is None:
+            return jsonify({'validation': report, 'error': 'Marker is not suitable for AR tracking'}), 422
         
-        # Check image quality
-        height, width = gray.shape
+        with metrics.stage('index'):
+            matches = descriptor_index.query(descriptors, request.args.get('limit', 5, type=int),
+                                             exclude_id=request.args.get('exclude'))
         
-        # Calculate image sharpness (Laplacian variance)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
+        return jsonify({'matches': matches, 'queryDescriptors': len(descriptors)})
         
-        # Validation criteria
-        valid = True
-        issues = []
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error querying marker index: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def run_compile_job(image_data, params):
+    """
+    Job entry point executed in a pool process; returns (meta, payload)
+    """
+    report, mind_file_data = compile_single_pass(image_data, params)
+    compile_cache.put(cache_key(image_data, dict(params, output='validation-report')), json.dumps(report).encode('utf-8'))
+    if mind_file_data is not None:
+        compile_cache.put(cache_key(image_data, params), mind_file_data)
+        metrics.observe('mindar_output_bytes', len(mind_file_data))
+    # Pool processes exit without running atexit hooks
+    metrics.flush()
+    return {'validation': report}, mind_file_data
+
+def run_compile_target_entry(image_data, params):
+    """
+    compile_target_entry for the process pool (flushes the pool process's metrics)
+    """
+    try:
+        return compile_target_entry(image_data, params)
+    finally:
+        metrics.flush()
+
+def run_video_job(input_path, params):
+    """
+    Video job entry point executed in a pool process; returns (meta, result file path)
+    The spooled upload is deleted once the job has run
+    """
+    output_path = input_path + '.' + params['format']
+    poster_path = input_path + '.poster.jpg'
+    try:
+        meta = prepare_video(input_path, output_path, poster_path,
+                             params['max_size'], params['max_fps'], params['format'])
+        for stage_name, seconds in meta['timings'].items():
+            metrics.observe('mindar_stage_duration_seconds', seconds, stage=stage_name)
+        metrics.observe('mindar_video_frames', meta['frames'])
+        return dict(meta, poster=os.path.basename(poster_path)), output_path
+    except Exception:
+        for path in (output_path, poster_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        os.remove(input_path)
+        # Pool processes exit without running atexit hooks
+        metrics.flush()
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Queue a single-pass compile and return immediately with a job id
+    """
+    try:
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        filename = request.headers.get('X-Filename', 'marker.jpg')
         
-        if feature_count < 50:
-            valid = False
-            issues.append(f"Not enough trackable features ({feature_count} found, need 50+)")
+        try:
+            params = request_compile_params()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # .mind bytes cached by /generate-mind skip validation, so a hit needs the cached report too
+        cached_report = compile_cache.get(cache_key(image_data, dict(params, output='validation-report')))
+        report = json.loads(cached_report) if cached_report is not None else None
+        mind_file_data = compile_cache.get(cache_key(image_data, params)) if report and report['valid'] else None
+        
+        if report is not None and (mind_file_data is not None or not report['valid']):
+            job = job_manager.complete({'validation': report}, mind_file_data, filename=filename)
+        else:
+            # Queued jobs hold their megapixels until the pool has finished them
+            reservation = admission.acquire(decoded_megapixels(header, params['max_size'], len(image_data)), kind='job')
+            try:
+                job = job_manager.submit(run_compile_job, image_data, params, filename=filename,
+                                         on_done=reservation.release)
+            except Exception:
+                reservation.release()
+                raise
+        
+        print(f"Job {job['id']} {job['status']}: {filename}, size: {len(image_data)} bytes")
+        
+        return jsonify(dict(job, statusUrl=f"/jobs/{job['id']}")), 202
+        
+    except QueueFullError as e:
+        return overloaded_response(Overloaded(str(e), retry_after=5))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error creating job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Poll a job; completed compile jobs include a resultUrl for the .mind file
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] == 'completed' and job.get('resultSize'):
+        job['resultUrl'] = f"/jobs/{job_id}/result"
+        if job.get('kind') == 'video':
+            job['posterUrl'] = f"/jobs/{job_id}/poster"
+    
+    return jsonify(job)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['status'] != 'completed' or not job.get('resultSize'):
+        return jsonify({'error': f"Job has no result (status: {job['status']})"}), 409
+    
+    filename = job.get('filename', 'marker.jpg')
+    if job.get('kind') == 'video':
+        # Streamed from disk in chunks, however long the clip
+        result = job['result']
+        response = app.response_class(iter_file_chunks(job_manager.result_path(job_id)),
+                                      mimetype=result['mimetype'], direct_passthrough=True)
+        response.content_length = job['resultSize']
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=os.path.splitext(filename)[0] + '.' + result['format'])
+        return response
+    
+    with open(job_manager.result_path(job_id), 'rb') as f:
+        mind_file_data = f.read()
+    return mind_file_response(mind_file_data, filename.replace('.jpg', '.mind').replace('.png', '.mind'))
+
+@app.route('/jobs/<job_id>/poster', methods=['GET'])
+def get_job_poster(job_id):
+    """
+    Poster frame (JPEG) of a completed video job
+    """
+    job = job_manager.get(job_id)
+    if job is None or job.get('kind') != 'video':
+        return jsonify({'error': 'Video job not found'}), 404
+    
+    if job['status'] != 'completed':
+        return jsonify({'error': f"Job has no poster (status: {job['status']})"}), 409
+    
+    poster = (job.get('result') or {}).get('poster')
+    try:
+        if not poster:
+            raise FileNotFoundError(poster)
+        return send_file(os.path.join(job_manager.jobs_dir, os.path.basename(poster)), mimetype='image/jpeg')
+    except FileNotFoundError:
+        # No frame could be written, or the poster was swept with the job's result
+        return jsonify({'error': 'Job has no poster'}), 404
+
+@app.route('/prepare-video', methods=['POST'])
+def create_video_job():
+    """
+    Queue server-side preparation of an overlay video (raw request body)
+    The clip is downscaled and re-encoded frame by frame in the job pool; the
+    result streams from /jobs/<id>/result and its poster frame from /jobs/<id>/poster
+    (?format=webm|mp4, ?max_size=N)
+    """
+    try:
+        video_format = request.args.get('format') or DEFAULT_VIDEO_FORMAT
+        if video_format not in available_video_formats():
+            return jsonify({'error': f"Unsupported video format: {video_format} "
+                                     f"(available: {', '.join(available_video_formats())})"}), 400
+        try:
+            max_size = int(request.args.get('max_size') or VIDEO_MAX_SIZE)
+        except ValueError:
+            return jsonify({'error': f"Invalid max_size: {request.args.get('max_size')}"}), 400
+        if not 64 <= max_size <= VIDEO_MAX_SIZE:
+            return jsonify({'error': f"max_size must be between 64 and {VIDEO_MAX_SIZE}"}), 400
+        params = {'format': video_format, 'max_size': max_size, 'max_fps': VIDEO_MAX_FPS}
+        filename = request.headers.get('X-Filename', 'overlay.mp4')
+        
+        try:
+            # Videos may be larger than MAX_CONTENT_LENGTH; spool_upload enforces VIDEO_MAX_BYTES
+            request.max_content_length = VIDEO_MAX_BYTES
+            input_path = spool_upload(request.stream, request.content_length, job_manager.jobs_dir, VIDEO_MAX_BYTES)
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        
+        try:
+            width, height, fps, frame_count = probe_video(input_path)
+            # Frames are decoded one at a time, so a job holds a single frame's megapixels
+            reservation = admission.acquire(width * height / 1e6, kind='job')
+            try:
+                job = job_manager.submit(run_video_job, input_path, params, kind='video', filename=filename,
+                                         on_done=reservation.release, inputs=[input_path])
+            except Exception:
+                reservation.release()
+                raise
+        except Exception:
+            os.remove(input_path)
+            raise
+        
+        print(f"Video job {job['id']} {job['status']}: {filename}, {width}x{height} @ {fps:.1f} fps, "
+              f"~{frame_count} frames")
+        
+        return jsonify(dict(job, statusUrl=f"/jobs/{job['id']}")), 202
+        
+    except UploadRejected as e:
+        return jsonify({'error': str(e)}), e.status
+    except QueueFullError as e:
+        return overloaded_response(Overloaded(str(e), retry_after=5))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error creating video job: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/generate-mind-batch', methods=['POST'])
+def generate_mind_batch():
+    """
+    Compile N uploaded images (multipart) into one multi-target .mind file
+    Targets are processed in parallel on the job process pool, in upload order
+    """
+    try:
+        uploads = [f for f in request.files.getlist('images') if f] or list(request.files.values())
+        filename = request.form.get('filename', 'targets.mind')
+        
+        if not uploads:
+            return jsonify({'error': 'No images provided (multipart field "images")'}), 400
+        try:
+            upload_limits.check_batch(len(uploads))
+        except UploadRejected as e:
+            return jsonify({'error': str(e)}), e.status
+        
+        images = [upload.read() for upload in uploads]
+        headers = []
+        for upload, data in zip(uploads, images):
+            try:
+                headers.append(upload_limits.check_image(data))
+            except UploadRejected as e:
+                return jsonify({'error': f"{upload.filename}: {e}"}), e.status
+        try:
+            params = request_compile_params()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        print(f"Processing batch of {len(images)} images, total size: {sum(len(data) for data in images)} bytes")
+        
+        megapixels = sum(decoded_megapixels(header, params['max_size'], len(data)) for header, data in zip(headers, images))
+        executor = job_manager.executor()
+        with admission.acquire(megapixels):
+            try:
+                results = list(executor.map(run_compile_target_entry, images, [params] * len(images)))
+            except BrokenProcessPool:
+                job_manager.discard_executor(executor)
+                raise
+        
+        reports = [dict(report, targetId=i, filename=upload.filename) for i, ((report, _), upload) in enumerate(zip(results, uploads))]
+        entries = [entry for _, entry in results]
+        
+        if any(entry is None for entry in entries):
+            return jsonify({'error': 'One or more targets failed validation', 'targets': reports}), 422
+        
+        mind_file_data = serialize_mind_data(entries, params['mind_format'], params['compression'])
+        print(f"Multi-target mind file created: {len(entries)} targets, size: {len(mind_file_data)} bytes")
+        metrics.observe('mindar_output_bytes', len(mind_file_data))
+        
+        return mind_file_response(mind_file_data, filename)
+        
+    except RequestEntityTooLarge:
+        return jsonify({'error': f"Batch too large (limit {upload_limits.max_batch_bytes} bytes "
+                                 f"and {upload_limits.max_batch_images} images)"}), 413
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        print(f"Error generating batch mind file: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def prewarm():
+    """
+    Run a synthetic compile and validation so imports, OpenCV's lazy
+    initialization and detector/CLAHE creation happen before the first real
+    request. The job process pool stays lazy: it only starts on the first
+    job. Safe to call more than once; only the first call works.
+    """
+    with _prewarm_lock:
+        if startup['ready']:
+            return
         
-        if laplacian_var < 100:
-            valid = False
-            issues.append(f"Image too blurry (sharpness: {laplacian_var:.1f})")
+        started = time.time()
         
-        if width < 200 or height < 200:
-            valid = False
-            issues.append(f"Image too small ({width}x{height}, need 200x200+)")
+        # Blocky random texture: enough corners for ORB, cheap to generate
+        rng = np.random.default_rng(0)
+        blocks = (rng.random((48, 64)) * 255).astype(np.uint8)
+        img = cv2.cvtColor(cv2.resize(blocks, (640, 480), interpolation=cv2.INTER_NEAREST), cv2.COLOR_GRAY2BGR)
+        success, jpeg_data = cv2.imencode('.jpg', img)
+        image_data = jpeg_data.tobytes()
         
-        return jsonify({
-            'valid': valid,
-            'featureCount': feature_count,
-            'sharpness': float(laplacian_var),
-            'dimensions': [width, height],
-            'issues': issues,
-            'recommendation': 'Good for AR tracking' if valid else 'Improve image quality for better tracking'
-        })
+        compile_single_pass(image_data, compile_params())
+        validate_target(image_data)
         
+        startup['prewarmSeconds'] = round(time.time() - started, 3)
+        startup['ready'] = True
+        print(f"Prewarm finished in {startup['prewarmSeconds']}s (pid {os.getpid()})")
+
+def record_compile_success():
+    if startup['firstCompileSeconds'] is None:
+        startup['firstCompileSeconds'] = round(time.time() - IMPORT_STARTED, 3)
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 503 until this worker has prewarmed (the probe itself triggers it)
+    """
+    if not startup['ready']:
+        try:
+            prewarm()
+        except Exception as e:
+            print(f"Prewarm error: {e}")
+            return jsonify({'ready': False, 'error': str(e), 'startup': startup}), 503
+    
+    return jsonify({'ready': True, 'pid': os.getpid(), 'startup': startup})
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({
+        'status': 'healthy',
+        'service': 'mindar-compiler',
+        'version': '1.0.0',
+        'cache': compile_cache.stats(),
+        'http': http_cache.stats(),
+        'jobs': job_manager.stats(),
+        'admission': admission.stats(),
+        'bufferPool': buffer_pool.stats(),
+        'markerIndex': descriptor_index.stats(),
+        'detectors': {'default': DEFAULT_DETECTOR, 'available': list(available_detectors())},
+        'video': {'default': DEFAULT_VIDEO_FORMAT, 'formats': list(available_video_formats()),
+                  'maxSize': VIDEO_MAX_SIZE, 'maxFps': VIDEO_MAX_FPS},
+        'startup': startup
+    })
+
+@app.before_request
+def begin_request_metrics():
+    request.metrics_started = time.perf_counter()
+    metrics.begin_request()
+    metrics.inc('mindar_in_flight_requests')
+
+@app.after_request
+def end_request_metrics(response):
+    started = getattr(request, 'metrics_started', None)
+    if started is None:
+        return response
+    
+    elapsed = time.perf_counter() - started
+    endpoint = request.endpoint or 'unknown'
+    metrics.observe('mindar_request_duration_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('mindar_requests_total', endpoint=endpoint, status=str(response.status_code))
+    if response.status_code >= 400:
+        reason = ERROR_REASONS.get(response.status_code, 'server_error' if response.status_code >= 500 else 'client_error')
+        metrics.inc('mindar_errors_total', reason=reason)
+    
+    response.headers['Server-Timing'] = metrics.server_timing_header(metrics.end_request(), elapsed)
+    return response
+
+@app.teardown_request
+def end_in_flight(exc):
+    # Runs even when a view raised, so the gauge cannot leak
+    if getattr(request, 'metrics_started', None) is not None:
+        metrics.dec('mindar_in_flight_requests')
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus metrics aggregated across all workers and pool processes
+    """
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/validate-image', methods=['POST'])
+def validate_image():
+    """
+    Validate if an image is suitable for AR tracking (?detector= picks the engine for the full tier)
+    """
+    try:
+        try:
+            image_data, header = read_request_image()
+        except UploadRejected as e:
+            return jsonify({'valid': False, 'reason': str(e), 'issues': [str(e)]}), e.status
+        
+        detector = request.args.get('detector') or DEFAULT_DETECTOR
+        if detector not in available_detectors():
+            reason = f"Unsupported detector: {detector}"
+            return jsonify({'valid': False, 'reason': reason, 'issues': [reason]}), 400
+        
+        # Small validations take the priority lane so big compiles cannot starve them
+        with admit_image(header, image_data, VALIDATION_MAX_SIZE, priority=True):
+            report = validate_target(image_data, ORB_FEATURES, detector)
+        return jsonify(report)
+        
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'valid': False, 'reason': str(e)})
 
+startup['importSeconds'] = round(time.time() - IMPORT_STARTED, 3)
+
 if __name__ == '__main__':
+    if os.environ.get('MINDAR_PREWARM', '1') != '0':
+        prewarm()
     app.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file
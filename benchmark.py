@@ -0,0 +1,571 @@
+#!/usr/bin/env python3
+"""
+In-process benchmark suite for the marker compile pipeline
+
+Generates a deterministic synthetic corpus (0.3 to 48 MP, JPEG and PNG,
+low and high feature density), runs the pipeline functions directly and
+through Flask's test client, and writes per-stage timings, peak memory,
+allocation counts and output sizes as JSON so runs can be compared across
+changes. The detect_features case also scores each detector engine's
+tracking quality (repeatability and correct matches under known warps):
+
+    python benchmark.py -o before.json
+    python benchmark.py -o after.json --compare before.json
+
+MINDAR_BUFFER_POOL=0 runs the pipeline without buffer reuse (see buffer_pool).
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import buffer_pool
+from detectors import available_detectors, detect_features
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Bump when the generator changes so cached corpus files are regenerated
+CORPUS_VERSION = 1
+
+SIZES = {
+    '0.3mp': (640, 480),
+    '2mp': (1632, 1224),
+    '12mp': (4000, 3000),
+    '48mp': (8000, 6000),
+}
+QUICK_SIZES = ('0.3mp', '2mp')
+FORMATS = ('jpg', 'png')
+DENSITIES = ('low', 'high')
+
+DIRECT_CASES = ('process_image_for_mindar', 'create_basic_mind_file', 'create_mindar_file', 'validate_image',
+                'detect_features')
+FLASK_CASES = ('/validate-image', '/generate-mind', '/compile')
+# Every case runs on every corpus image (SIZES x FORMATS x DENSITIES). These
+# cases also run once per preprocessing mode (target_compiler.PREPROCESS_MODES,
+# narrowed with --preprocess)
+PREPROCESS = ('gray', 'color')
+PREPROCESS_CASES = ('process_image_for_mindar', 'create_basic_mind_file', '/generate-mind', '/compile')
+# Cases run once per detector engine (detectors.available_detectors())
+DETECTOR_CASES = ('detect_features',)
+
+# Tracking quality: (rotation degrees, scale, perspective tilt) warps of the
+# processed image; a keypoint or match is correct within this many pixels
+QUALITY_WARPS = ((15, 1.0, 0.0), (0, 0.7, 0.0), (30, 0.85, 0.0003), (-10, 1.2, -0.0002))
+QUALITY_TOLERANCE = 3.0
+
+RSS_SAMPLE_INTERVAL = 0.002
+
+
+def configure_service_env(work_dir):
+    """
+    Environment for the in-process service: compile cache effectively off
+    (every request compiles), scratch dirs, and upload limits that admit
+    the largest corpus images
+    """
+    os.environ.setdefault('MINDAR_CACHE_DIR', os.path.join(work_dir, 'cache'))
+    os.environ.setdefault('MINDAR_CACHE_MEMORY_MB', '0')
+    os.environ.setdefault('MINDAR_CACHE_MAX_AGE', '-1')
+    os.environ.setdefault('MINDAR_JOBS_DIR', os.path.join(work_dir, 'jobs'))
+    os.environ.setdefault('MINDAR_METRICS_DIR', os.path.join(work_dir, 'metrics'))
+    os.environ.setdefault('MINDAR_UPLOAD_MAX_MB', '512')
+    os.environ.setdefault('MINDAR_PREWARM', '0')
+
+
+def load_cli():
+    """
+    Import python-mindar-compiler.py (not importable by name because of the dashes)
+    """
+    spec = importlib.util.spec_from_file_location('mindar_cli', os.path.join(HERE, 'python-mindar-compiler.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate_image(width, height, density, seed):
+    """
+    Deterministic synthetic marker-like image
+
+    'high' density is a blocky random texture with shapes and text (many
+    corners); 'low' density is smooth gradients with a few soft blobs.
+    """
+    rng = np.random.default_rng(seed)
+
+    if density == 'high':
+        block = max(4, min(width, height) // 96)
+        cells = (rng.random((height // block + 1, width // block + 1, 3)) * 255).astype(np.uint8)
+        img = cv2.resize(cells, None, fx=block, fy=block, interpolation=cv2.INTER_NEAREST)[:height, :width]
+        img = np.ascontiguousarray(img)
+        for _ in range(60):
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            radius = int(rng.integers(block, block * 12))
+            cv2.circle(img, center, radius, tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+        for _ in range(20):
+            origin = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+            cv2.putText(img, 'MINDAR', origin, cv2.FONT_HERSHEY_SIMPLEX, block / 6, (0, 0, 0), max(1, block // 3))
+        return img
+
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    img = np.empty((height, width, 3), np.uint8)
+    for channel in range(3):
+        phase = rng.random() * np.pi
+        img[..., channel] = (127 + 100 * np.sin(phase + 3 * x + 2 * y)).astype(np.uint8)
+    for _ in range(6):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(min(width, height) // 12, min(width, height) // 4))
+        cv2.circle(img, center, radius, tuple(int(c) for c in rng.integers(0, 256, 3)), -1)
+    blur = (min(width, height) // 40) | 1
+    return cv2.GaussianBlur(img, (blur, blur), 0)
+
+
+def build_corpus(corpus_dir, sizes, formats, densities):
+    """
+    Generate (or reuse) the corpus; returns a list of image descriptors with bytes
+    """
+    os.makedirs(corpus_dir, exist_ok=True)
+    corpus = []
+
+    for size_index, size in enumerate(sizes):
+        width, height = SIZES[size]
+        for density_index, density in enumerate(densities):
+            seed = 1000 * CORPUS_VERSION + 10 * size_index + density_index
+            img = None
+            for fmt in formats:
+                name = f"v{CORPUS_VERSION}-{size}-{density}.{fmt}"
+                path = os.path.join(corpus_dir, name)
+                if not os.path.exists(path):
+                    if img is None:
+                        img = generate_image(width, height, density, seed)
+                    success, encoded = cv2.imencode('.' + fmt, img)
+                    if not success:
+                        raise RuntimeError(f"Could not encode {name}")
+                    encoded.tofile(path)
+                    print(f"🖼️  Generated {name} ({os.path.getsize(path)} bytes)")
+
+                with open(path, 'rb') as f:
+                    data = f.read()
+                corpus.append({
+                    'image': name,
+                    'size': size,
+                    'megapixels': round(width * height / 1e6, 2),
+                    'format': fmt,
+                    'density': density,
+                    'inputBytes': len(data),
+                    'data': data,
+                })
+
+    return corpus
+
+
+class PeakMemory:
+    """
+    Peak memory over a block
+
+    peakMemoryMb is the tracemalloc peak: Python objects and every NumPy
+    array, including the ones OpenCV returns. rssGrowthMb is how far resident
+    memory (sampled from /proc) rose above its starting point. That catches
+    OpenCV-internal buffers such as a full-resolution PNG decode, which are
+    large enough to be mmapped and released to the OS again. Small buffers
+    that reuse heap freed by the warm-up call do not show up in it.
+    """
+
+    def __enter__(self):
+        self.baseline = self._rss()
+        self.peak = self.baseline
+        self._stop = threading.Event()
+        self._thread = None
+        if self.baseline is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        tracemalloc.start()
+        return self
+
+    def __exit__(self, *exc):
+        _, self.traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.peak = max(self.peak, self._rss())
+        return False
+
+    @staticmethod
+    def _rss():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError):
+            return None
+
+    def _sample(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = self._rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def result(self):
+        return {
+            'peakMemoryMb': round(self.traced_peak / 2**20, 2),
+            'rssGrowthMb': round((self.peak - self.baseline) / 2**20, 2) if self.baseline is not None else None,
+        }
+
+
+def parse_server_timing(header):
+    """
+    Server-Timing header -> {name: milliseconds}
+    """
+    stages = {}
+    for part in (header or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.startswith('dur='):
+            stages[name] = float(params[4:])
+    return stages
+
+
+class Suite:
+    """
+    Benchmark cases over the corpus; each case maps an image to a callable
+    returning (output_bytes, stage_ms, status)
+    """
+
+    def __init__(self):
+        # Imported here so configure_service_env applies to the service globals
+        import app as service
+        import metrics
+
+        self.service = service
+        self.metrics = metrics
+        self.cli = load_cli()
+        self.client = service.app.test_client()
+        self.params = service.compile_params()
+        self._processed = {}
+
+    def _direct(self, fn):
+        self.metrics.begin_request()
+        result = fn()
+        stages = {}
+        for name, elapsed in self.metrics.end_request():
+            stages[name] = stages.get(name, 0.0) + elapsed * 1000
+        return result, stages
+
+    def _processed_image(self, entry, which, preprocess=None):
+        key = (entry['image'], which, preprocess)
+        if key not in self._processed:
+            if which == 'service':
+                self._processed[key] = self.service.process_image_for_mindar(entry['data'], preprocess=preprocess)
+            else:
+                self._processed[key] = self.cli.process_image_for_mindar(entry['data'])
+        return self._processed[key]
+
+    def case(self, name, entry, preprocess=None, detector=None):
+        data = entry['data']
+        service = self.service
+        params = service.compile_params(preprocess=preprocess, detector=detector)
+
+        if name == 'process_image_for_mindar':
+            def run():
+                img, stages = self._direct(lambda: service.process_image_for_mindar(
+                    data, params['max_size'], params['clahe_clip_limit'], params['clahe_tile_grid'],
+                    preprocess=params['preprocess']))
+                return None, stages, 'ok' if img is not None else 'failed'
+
+        elif name == 'create_basic_mind_file':
+            processed = self._processed_image(entry, 'service', params['preprocess'])
+
+            def run():
+                mind, stages = self._direct(lambda: service.create_basic_mind_file(
+                    processed, params['nfeatures'],
+                    mind_format=params['mind_format'], compression=params['compression'],
+                    feature_budget=params['feature_budget']))
+                return len(mind) if mind else None, stages, 'ok' if mind else 'failed'
+
+        elif name == 'detect_features':
+            processed = self._processed_image(entry, 'service', 'gray')
+
+            def run():
+                features, stages = self._direct(lambda: service.extract_features(
+                    processed, params['nfeatures'], params['detector']))
+                return None, stages, 'ok' if features[2] is not None else 'failed'
+
+        elif name == 'create_mindar_file':
+            processed = self._processed_image(entry, 'cli')
+
+            def run():
+                mind = self.cli.create_mindar_file(processed)
+                return len(mind) if mind else None, {}, 'ok' if mind else 'failed'
+
+        elif name == 'validate_image':
+            def run():
+                report = self.cli.validate_image(data)
+                return None, {}, 'valid' if report.get('valid') else 'invalid'
+
+        else:
+            query = (['format=binary'] if name == '/compile' else []) + ([f'preprocess={preprocess}'] if preprocess else [])
+            path = name + ('?' + '&'.join(query) if query else '')
+
+            def run():
+                response = self.client.post(path, data=data, headers={'X-Filename': entry['image']})
+                body = response.get_data()
+                stages = parse_server_timing(response.headers.get('Server-Timing'))
+                stages.pop('total', None)
+                output = len(body) if name != '/validate-image' and response.status_code == 200 else None
+                return output, stages, response.status_code
+
+        return run
+
+
+def warp_homography(width, height, degrees, scale, tilt):
+    """
+    Rotation and scale about the image center plus a perspective tilt, as a 3x3 homography
+    """
+    rotation = np.vstack([cv2.getRotationMatrix2D((width / 2, height / 2), degrees, scale), [0, 0, 1]])
+    perspective = np.array([[1, 0, 0], [0, 1, 0], [tilt, tilt / 2, 1]])
+    return perspective @ rotation
+
+
+def tracking_quality(gray, detector, nfeatures):
+    """
+    How well a detector's features survive known warps of gray, averaged over QUALITY_WARPS
+
+    repeatability: share of keypoints (that stay in view) re-detected within
+    QUALITY_TOLERANCE px; matchingScore: share of keypoints whose cross-checked
+    Hamming match is geometrically correct; matchPrecision: share of matches
+    that are correct.
+    """
+    height, width = gray.shape
+    keypoints, descriptors = detect_features(gray, detector, nfeatures)
+    points = cv2.KeyPoint_convert(keypoints).reshape(-1, 1, 2)
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    scores = {'repeatability': [], 'matchingScore': [], 'matchPrecision': []}
+
+    for degrees, scale, tilt in QUALITY_WARPS:
+        homography = warp_homography(width, height, degrees, scale, tilt)
+        warped = cv2.warpPerspective(gray, homography, (width, height))
+        warped_keypoints, warped_descriptors = detect_features(warped, detector, nfeatures)
+        if descriptors is None or warped_descriptors is None:
+            for values in scores.values():
+                values.append(0.0)
+            continue
+
+        projected = cv2.perspectiveTransform(points, homography).reshape(-1, 2)
+        targets = cv2.KeyPoint_convert(warped_keypoints)
+        visible = ((projected >= 0) & (projected < (width, height))).all(axis=1)
+        distances = np.linalg.norm(projected[visible, None, :] - targets[None, :, :], axis=2)
+        scores['repeatability'].append(float((distances.min(axis=1) <= QUALITY_TOLERANCE).mean()) if visible.any() else 0.0)
+
+        matches = matcher.match(descriptors, warped_descriptors)
+        correct = sum(1 for m in matches
+                      if np.linalg.norm(projected[m.queryIdx] - targets[m.trainIdx]) <= QUALITY_TOLERANCE)
+        scores['matchingScore'].append(correct / max(int(visible.sum()), 1))
+        scores['matchPrecision'].append(correct / len(matches) if matches else 0.0)
+
+    quality = {name: round(float(np.mean(values)), 4) for name, values in scores.items()}
+    quality['features'] = len(keypoints)
+    return quality
+
+
+def measure(run, repeat):
+    """
+    One warm-up call, repeat timed calls, then one call under memory tracking
+    Page faults and buffer pool allocations are per timed call (medians)
+    """
+    run()
+
+    times = []
+    faults = []
+    allocations = []
+    stage_samples = {}
+    for _ in range(repeat):
+        faults_before = resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+        allocations_before = buffer_pool.stats()['allocations']
+        started = time.perf_counter()
+        output, stages, status = run()
+        times.append((time.perf_counter() - started) * 1000)
+        faults.append(resource.getrusage(resource.RUSAGE_SELF).ru_minflt - faults_before)
+        allocations.append(buffer_pool.stats()['allocations'] - allocations_before)
+        for name, ms in stages.items():
+            stage_samples.setdefault(name, []).append(ms)
+
+    with PeakMemory() as memory:
+        run()
+
+    return dict({
+        'status': status,
+        'timesMs': {
+            'median': round(statistics.median(times), 3),
+            'min': round(min(times), 3),
+            'max': round(max(times), 3),
+        },
+        'stagesMs': {name: round(statistics.median(samples), 3) for name, samples in stage_samples.items()},
+        'pageFaults': statistics.median(faults),
+        'poolAllocations': statistics.median(allocations),
+        'outputBytes': output,
+    }, **memory.result())
+
+
+def environment_info():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE,
+                                capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpuCount': os.cpu_count(),
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'opencvThreads': cv2.getNumThreads(),
+    }
+
+
+def case_variants(case, args):
+    """
+    Per-case parameter variants: preprocessing modes or detector engines
+    """
+    if case in PREPROCESS_CASES:
+        return [{'preprocess': preprocess} for preprocess in args.preprocess]
+    if case in DETECTOR_CASES:
+        return [{'detector': detector} for detector in args.detectors]
+    return [{}]
+
+
+def result_label(result):
+    variant = result.get('preprocess') or result.get('detector')
+    return f"{result['case']}[{variant}]" if variant else result['case']
+
+
+def run_suite(args):
+    work_dir = tempfile.mkdtemp(prefix='mindar-bench-')
+    configure_service_env(work_dir)
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else tuple(SIZES))
+    corpus = build_corpus(args.corpus_dir, sizes, args.formats, args.densities)
+    suite = Suite()
+    cases = [c for c in DIRECT_CASES + FLASK_CASES if not args.cases or c in args.cases]
+
+    results = []
+    for entry in corpus:
+        for case in cases:
+            for variant in case_variants(case, args):
+                result = dict({k: v for k, v in entry.items() if k != 'data'},
+                              case=case, preprocess=variant.get('preprocess'), detector=variant.get('detector'),
+                              **measure(suite.case(case, entry, **variant), args.repeat))
+                if case in DETECTOR_CASES:
+                    gray = suite._processed_image(entry, 'service', 'gray')
+                    result['quality'] = tracking_quality(gray, variant['detector'], suite.params['nfeatures'])
+                results.append(result)
+                quality = result.get('quality')
+                print(f"⏱️  {result_label(result):<32} {entry['image']:<24} {result['timesMs']['median']:>9.1f} ms  "
+                      f"peak {result['peakMemoryMb']:>7.2f} MB rss +{result['rssGrowthMb']} MB  "
+                      f"faults {result['pageFaults']:>6g} allocs {result['poolAllocations']:g}  "
+                      f"out {result['outputBytes']}  [{result['status']}]"
+                      + (f"  repeat {quality['repeatability']:.2f} match {quality['matchingScore']:.2f} "
+                         f"precision {quality['matchPrecision']:.2f}" if quality else ''))
+
+    return {
+        'environment': environment_info(),
+        'config': {
+            'corpusVersion': CORPUS_VERSION,
+            'repeat': args.repeat,
+            'compileParams': suite.params,
+            'bufferPool': buffer_pool.enabled,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold, min_delta_ms, min_delta_mb=1.0):
+    """
+    Print median time and peak memory changes against a baseline run
+    Returns the cases that regressed in either
+    """
+    # Results from before preprocessing modes existed ran the color path
+    def key(r):
+        return (r['case'], r['image'], r.get('preprocess', 'color' if r['case'] in PREPROCESS_CASES else None),
+                r.get('detector'))
+
+    previous = {key(r): r for r in baseline['results']}
+    regressions = []
+
+    print(f"\n📊 Compared with {baseline['environment'].get('commit')} ({baseline['environment'].get('timestamp')})")
+    for result in current['results']:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+
+        new_ms = result['timesMs']['median']
+        old_ms = old['timesMs']['median']
+        ratio = new_ms / old_ms if old_ms else float('inf')
+        new_mb = result['peakMemoryMb']
+        old_mb = old.get('peakMemoryMb', new_mb)
+        regressed = ratio > 1 + threshold and new_ms - old_ms > min_delta_ms
+        for field in ('peakMemoryMb', 'rssGrowthMb'):
+            new_value, old_value = result.get(field) or 0, old.get(field) or 0
+            if new_value > old_value * (1 + threshold) and new_value - old_value > min_delta_mb:
+                regressed = True
+        if regressed:
+            regressions.append(result)
+
+        marker = '❌' if regressed else ('✅' if ratio < 1 - threshold else '  ')
+        print(f"{marker} {result_label(result):<32} {result['image']:<24} {old_ms:>9.1f} -> {new_ms:>9.1f} ms "
+              f"({ratio:.2f}x)  peak {old_mb:.2f} -> {new_mb:.2f} MB  out {old.get('outputBytes')} -> {result['outputBytes']}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MindAR marker compile pipeline in-process")
+    parser.add_argument('-o', '--output', default='benchmark-results.json', help="Results JSON file")
+    parser.add_argument('--compare', metavar='BASELINE', help="Earlier results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="Relative slowdown counted as a regression (default: 0.15)")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="Ignore slowdowns smaller than this many ms (default: 1.0)")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case (default: 3)")
+    parser.add_argument('--quick', action='store_true', help="Only the small corpus sizes")
+    parser.add_argument('--sizes', nargs='+', choices=tuple(SIZES), help="Corpus sizes to run")
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--densities', nargs='+', choices=DENSITIES, default=DENSITIES)
+    parser.add_argument('--cases', nargs='+', choices=DIRECT_CASES + FLASK_CASES, help="Cases to run (default: all)")
+    parser.add_argument('--preprocess', nargs='+', choices=PREPROCESS, default=PREPROCESS,
+                        help="Preprocessing modes for the service pipeline cases (default: both)")
+    parser.add_argument('--detectors', nargs='+', choices=available_detectors(), default=available_detectors(),
+                        help="Detector engines for the detect_features case (default: all available)")
+    parser.add_argument('--corpus-dir', default=os.path.join(tempfile.gettempdir(), 'mindar-bench-corpus'),
+                        help="Where generated corpus images are kept between runs")
+    args = parser.parse_args()
+
+    report = run_suite(args)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📁 Results saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"❌ {len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+        print("✅ No regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Reusable NumPy buffers for the image pipeline.
+
+Every stage of the compile pipeline (resize, color conversion, CLAHE,
+...) used to return a freshly allocated array, so each request churned
+through a dozen multi-hundred-KB allocations and their page faults.
+Stages now ask the pool for a buffer and pass it to OpenCV as dst=.
+
+Buffers are kept per thread (threaded gunicorn workers never share one)
+and per tag, so buffers that are alive at the same time within one
+pipeline run never alias. Capacities are bucketed to powers of two, so
+images of similar size reuse the same allocation, and the returned array
+is a C-contiguous view of the exact shape requested.
+
+A buffer is only valid until the same thread asks for the same tag
+again: never return one from a request or keep it across calls. Set
+MINDAR_BUFFER_POOL=0 to allocate fresh arrays instead (the counters keep
+working, which makes before/after comparisons easy).
+"""
+
+import os
+import threading
+
+import numpy as np
+
+MIN_BUCKET = 64 * 1024
+
+_local = threading.local()
+_lock = threading.Lock()
+_counters = {'allocations': 0, 'reuses': 0, 'allocatedBytes': 0}
+enabled = os.environ.get('MINDAR_BUFFER_POOL', '1') != '0'
+
+
+def _bucket(nbytes):
+    return max(MIN_BUCKET, 1 << (nbytes - 1).bit_length())
+
+
+def _count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def take(tag, shape, dtype=np.uint8):
+    """
+    Buffer of the given shape and dtype for stage tag, reused across calls on this thread
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+
+    if not enabled:
+        _count('allocations')
+        _count('allocatedBytes', nbytes)
+        return np.empty(shape, dtype)
+
+    arena = getattr(_local, 'arena', None)
+    if arena is None:
+        arena = _local.arena = {}
+
+    flat = arena.get(tag)
+    if flat is None or flat.nbytes < nbytes or flat.nbytes > 4 * _bucket(nbytes):
+        # Also reallocate when far too big, so one huge image does not pin memory forever
+        flat = arena[tag] = np.empty(_bucket(nbytes), np.uint8)
+        _count('allocations')
+        _count('allocatedBytes', flat.nbytes)
+    else:
+        _count('reuses')
+
+    return flat[:nbytes].view(dtype).reshape(shape)
+
+
+def stats():
+    with _lock:
+        return dict(_counters, enabled=enabled)
+
+
+def _reset_after_fork():
+    # Counters are per process; buffers inherited by the child stay usable
+    global _lock, _counters
+    _lock = threading.Lock()
+    _counters = {'allocations': 0, 'reuses': 0, 'allocatedBytes': 0}
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
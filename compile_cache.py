@@ -0,0 +1,228 @@
+"""
+Content-addressed cache for compiled .mind files.
+
+Entries are keyed by a hash of the uploaded image bytes plus the compile
+parameters. A small in-process LRU sits in front of a disk store that all
+gunicorn workers on the same instance share.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'mindar-cache')
+
+
+def cache_key(image_data, params):
+    """
+    Build a content-addressed key from the image bytes and compile parameters
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(image_data)
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """
+    Two-tier (memory LRU + shared disk) cache with eviction by size and age
+    """
+
+    def __init__(self, cache_dir=None, memory_max_bytes=32 * 1024 * 1024,
+                 disk_max_bytes=512 * 1024 * 1024, max_age=7 * 24 * 3600,
+                 disk_sweep_interval=30):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.max_age = max_age
+        self.disk_sweep_interval = disk_sweep_interval
+
+        self._memory = OrderedDict()  # key -> (stored_at, data)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._sweeping = False
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a cache configured from MINDAR_CACHE_* environment variables
+        """
+        return cls(
+            cache_dir=os.environ.get('MINDAR_CACHE_DIR') or None,
+            memory_max_bytes=int(float(os.environ.get('MINDAR_CACHE_MEMORY_MB', 32)) * 1024 * 1024),
+            disk_max_bytes=int(float(os.environ.get('MINDAR_CACHE_DISK_MB', 512)) * 1024 * 1024),
+            max_age=int(os.environ.get('MINDAR_CACHE_MAX_AGE', 7 * 24 * 3600)),
+        )
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.mind')
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key):
+        """
+        Return cached bytes for key, or None on a miss
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                stored_at, data = entry
+                if now - stored_at <= self.max_age:
+                    self._memory.move_to_end(key)
+                    self._counters['memory_hits'] += 1
+                    return data
+                self._drop_memory_entry(key)
+
+        path = self._path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if now - mtime > self.max_age:
+                os.remove(path)
+                self._count('evictions')
+                raise FileNotFoundError(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            # Touch the file so disk eviction is least-recently-used
+            os.utime(path, None)
+        except OSError:
+            self._count('misses')
+            return None
+
+        self._count('disk_hits')
+        self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        """
+        Store bytes under key in both tiers
+        """
+        self._remember(key, data)
+
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file and rename so other workers never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Cache write error: {e}")
+            return
+
+        self._count('stores')
+        self._maybe_sweep_disk()
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_max_bytes:
+            return
+
+        with self._lock:
+            if key in self._memory:
+                self._drop_memory_entry(key)
+            self._memory[key] = (time.time(), data)
+            self._memory_bytes += len(data)
+
+            while self._memory_bytes > self.memory_max_bytes:
+                oldest = next(iter(self._memory))
+                self._drop_memory_entry(oldest)
+                self._counters['evictions'] += 1
+
+    def _drop_memory_entry(self, key):
+        # Caller must hold self._lock
+        _, data = self._memory.pop(key)
+        self._memory_bytes -= len(data)
+
+    def _maybe_sweep_disk(self):
+        # The sweep walks the whole disk tier, so it runs on a daemon thread
+        # rather than in the put() of whichever request crossed the interval
+        now = time.time()
+        with self._lock:
+            if self._sweeping or now - self._last_sweep < self.disk_sweep_interval:
+                return
+            self._last_sweep = now
+            self._sweeping = True
+
+        def run():
+            try:
+                self.sweep_disk()
+            except Exception as e:
+                print(f"Cache sweep error: {e}")
+            finally:
+                self._sweeping = False
+
+        threading.Thread(target=run, name='compile-cache-sweep', daemon=True).start()
+
+    def sweep_disk(self):
+        """
+        Remove expired entries, then the least recently used until under the size limit
+        """
+        now = time.time()
+        entries = []
+        total = 0
+        removed = 0
+
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total > self.disk_max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    removed += 1
+                    total -= size
+                except OSError:
+                    pass
+
+        if removed:
+            self._count('evictions', removed)
+        return total
+
+    def stats(self):
+        """
+        Hit/miss counters for this worker plus memory tier usage
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['memory_entries'] = len(self._memory)
+            counters['memory_bytes'] = self._memory_bytes
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        counters['hit_rate'] = round((counters['memory_hits'] + counters['disk_hits']) / lookups, 4) if lookups else 0.0
+        counters['pid'] = os.getpid()
+        return counters
@@ -0,0 +1,364 @@
+"""
+Similarity index over marker ORB descriptors, used to find markers that
+look too much like existing ones (and would be cross-detected).
+
+Descriptors are bucketed with bit-sampling LSH over Hamming space: each of
+TABLES hash tables keys a 256-bit descriptor by BITS_PER_KEY fixed random
+bit positions. Descriptors of the same physical feature differ in few bits
+and so share a key in at least one table with high probability, while
+unrelated descriptors almost never do. A query looks up each of its
+descriptors by binary search in every table (O(log N), no scan over the
+catalog), verifies the candidates by exact Hamming distance and counts
+matched descriptors per marker.
+
+The index is a directory of immutable segments, each a set of .npy arrays
+opened with mmap_mode='r', so workers share pages through the OS cache and
+nothing is loaded up front. add() writes a new segment atomically (temp
+dir + rename) so concurrent readers in other processes never see partial
+data; compact() merges segments and drops replaced markers. add() never
+compacts: the service calls compact_in_background() after adding and the
+CLI compacts explicitly, so no request waits on a merge.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+DESCRIPTOR_BYTES = 32
+BITS_PER_KEY = 20
+TABLES = 16
+
+# Descriptors kept per marker (strongest responses first)
+DESCRIPTORS_PER_MARKER = 256
+
+# Candidate pairs closer than this many bits count as matching descriptors
+MATCH_DISTANCE = 64
+
+# Buckets larger than this hold degenerate descriptors (e.g. flat patches)
+# shared by many markers; they say nothing about similarity
+MAX_BUCKET = 2048
+
+# compact_in_background() merges segments once there are more than this many
+MAX_SEGMENTS = 32
+
+# Rows processed at a time when hashing, to bound the unpacked bit matrix
+HASH_CHUNK = 65536
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def select_descriptors(descriptors, responses=None, limit=DESCRIPTORS_PER_MARKER):
+    """
+    Strongest limit descriptors (by keypoint response) as a uint8 (N, 32) array
+    """
+    descriptors = np.asarray(descriptors, dtype=np.uint8).reshape(-1, DESCRIPTOR_BYTES)
+    if responses is not None and len(descriptors) > limit:
+        strongest = np.argsort(-np.asarray(responses, dtype=np.float32), kind='stable')[:limit]
+        descriptors = descriptors[np.sort(strongest)]
+    return np.ascontiguousarray(descriptors[:limit])
+
+
+def hamming_distances(a, b):
+    """
+    Row-wise Hamming distance between two uint8 (N, 32) arrays
+    """
+    return _POPCOUNT[np.bitwise_xor(a, b)].sum(axis=1, dtype=np.uint16)
+
+
+class DescriptorIndex:
+    """
+    Memory-mapped LSH index of marker descriptors, safe to share across processes
+    """
+
+    def __init__(self, index_dir, bits_per_key=BITS_PER_KEY, tables=TABLES, seed=0):
+        self.index_dir = index_dir
+        self._lock = threading.Lock()
+        self._segments = {}  # name -> loaded segment
+        self._listing = None
+        self._compacting = False
+
+        os.makedirs(index_dir, exist_ok=True)
+        config_path = os.path.join(index_dir, 'index.json')
+        with self._exclusive():
+            try:
+                with open(config_path) as f:
+                    config = json.load(f)
+            except FileNotFoundError:
+                rng = np.random.default_rng(seed)
+                positions = [sorted(rng.choice(DESCRIPTOR_BYTES * 8, bits_per_key, replace=False).tolist())
+                             for _ in range(tables)]
+                config = {'version': FORMAT_VERSION, 'bitsPerKey': bits_per_key, 'positions': positions}
+                _write_json_atomic(config_path, config)
+
+        if config.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported descriptor index version: {config.get('version')}")
+        self.positions = np.array(config['positions'], dtype=np.intp)
+        self._weights = (1 << np.arange(self.positions.shape[1], dtype=np.uint32)).astype(np.uint32)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Index in MINDAR_INDEX_DIR (default: <tmp>/mindar-index)
+        """
+        return cls(os.environ.get('MINDAR_INDEX_DIR') or os.path.join(tempfile.gettempdir(), 'mindar-index'))
+
+    def _exclusive(self):
+        return _FileLock(os.path.join(self.index_dir, '.lock'))
+
+    def hash_keys(self, descriptors):
+        """
+        LSH keys, a uint32 (TABLES, N) array
+        """
+        keys = np.empty((len(self.positions), len(descriptors)), dtype=np.uint32)
+        for start in range(0, len(descriptors), HASH_CHUNK):
+            bits = np.unpackbits(descriptors[start:start + HASH_CHUNK], axis=1)
+            for table, positions in enumerate(self.positions):
+                keys[table, start:start + HASH_CHUNK] = bits[:, positions].astype(np.uint32) @ self._weights
+        return keys
+
+    def add(self, marker_id, descriptors, info=None):
+        """
+        Add (or replace) one marker; see add_many
+        """
+        self.add_many([(marker_id, descriptors, info)])
+
+    def add_many(self, markers):
+        """
+        Add markers given as (marker_id, descriptors, info) tuples in one new segment
+        Re-adding an existing marker_id replaces the earlier entry.
+        """
+        markers = [(str(marker_id), np.asarray(descriptors, dtype=np.uint8).reshape(-1, DESCRIPTOR_BYTES), info)
+                   for marker_id, descriptors, info in markers]
+        markers = [m for m in markers if len(m[1])]
+        if not markers:
+            return
+
+        descriptors = np.concatenate([d for _, d, _ in markers])
+        owners = np.concatenate([np.full(len(d), i, dtype=np.uint32) for i, (_, d, _) in enumerate(markers)])
+        meta = [{'id': marker_id, 'descriptors': len(d), 'info': info or {}, 'added': time.time()}
+                for marker_id, d, info in markers]
+
+        self._write_segment(descriptors, owners, meta)
+
+    def _write_segment(self, descriptors, owners, meta, name=None):
+        keys = self.hash_keys(descriptors)
+        order = np.argsort(keys, axis=1, kind='stable').astype(np.uint32)
+        sorted_keys = np.take_along_axis(keys, order.astype(np.intp), axis=1)
+
+        # Segment names sort by creation so later segments replace earlier markers
+        name = name or f"seg-{time.time_ns():020d}-{os.getpid()}"
+        tmp_dir = tempfile.mkdtemp(dir=self.index_dir, prefix='.tmp-')
+        np.save(os.path.join(tmp_dir, 'descriptors.npy'), descriptors)
+        np.save(os.path.join(tmp_dir, 'owners.npy'), owners)
+        np.save(os.path.join(tmp_dir, 'keys.npy'), sorted_keys)
+        np.save(os.path.join(tmp_dir, 'order.npy'), order)
+        with open(os.path.join(tmp_dir, 'markers.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp_dir, os.path.join(self.index_dir, name))
+        return name
+
+    def _list_segments(self):
+        return sorted(name for name in os.listdir(self.index_dir) if name.startswith('seg-'))
+
+    def _load(self):
+        """
+        Current segments (oldest first), reopening only ones not seen before
+        """
+        names = self._list_segments()
+        with self._lock:
+            if names != self._listing:
+                loaded = {}
+                for name in names:
+                    segment = self._segments.get(name)
+                    if segment is None:
+                        path = os.path.join(self.index_dir, name)
+                        try:
+                            with open(os.path.join(path, 'markers.json')) as f:
+                                markers = json.load(f)
+                            segment = {
+                                'name': name,
+                                'markers': markers,
+                                'descriptors': np.load(os.path.join(path, 'descriptors.npy'), mmap_mode='r'),
+                                'owners': np.load(os.path.join(path, 'owners.npy'), mmap_mode='r'),
+                                'keys': np.load(os.path.join(path, 'keys.npy'), mmap_mode='r'),
+                                'order': np.load(os.path.join(path, 'order.npy'), mmap_mode='r'),
+                            }
+                        except (OSError, ValueError):
+                            # Removed by a concurrent compaction; the next listing has its replacement
+                            continue
+                    loaded[name] = segment
+                segments = [loaded[name] for name in names if name in loaded]
+                
+                # Markers re-added in a later segment hide their earlier entries
+                latest = {}
+                for segment_index, segment in enumerate(segments):
+                    for marker_index, marker in enumerate(segment['markers']):
+                        latest[marker['id']] = (segment_index, marker_index)
+
+                self._segments = loaded
+                self._listing = names
+                self._current = (segments, latest)
+            return self._current
+
+    def query(self, descriptors, limit=5, exclude_id=None, match_distance=MATCH_DISTANCE):
+        """
+        Most similar indexed markers to a query marker's descriptors
+
+        Returns up to limit dicts (most similar first) with the marker id,
+        info, the number of query descriptors with a match in that marker and
+        score = matches / query descriptors.
+        """
+        query = np.ascontiguousarray(np.asarray(descriptors, dtype=np.uint8).reshape(-1, DESCRIPTOR_BYTES))
+        if not len(query):
+            return []
+
+        query_keys = self.hash_keys(query)
+        segments, latest = self._load()
+        votes = {}
+
+        for segment_index, segment in enumerate(segments):
+            keys, order = segment['keys'], segment['order']
+            query_rows, stored_rows = [], []
+
+            for table in range(len(self.positions)):
+                lo = np.searchsorted(keys[table], query_keys[table], side='left')
+                hi = np.searchsorted(keys[table], query_keys[table], side='right')
+                sizes = hi - lo
+                usable = (sizes > 0) & (sizes <= MAX_BUCKET)
+                if not usable.any():
+                    continue
+
+                # Expand every (query descriptor, bucket) into candidate rows without a Python loop
+                sizes, lo = sizes[usable], lo[usable]
+                query_index = np.repeat(np.flatnonzero(usable), sizes)
+                offsets = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+                query_rows.append(query_index)
+                stored_rows.append(order[table][np.repeat(lo, sizes) + offsets])
+
+            if not query_rows:
+                continue
+
+            # Candidates found by several tables are verified once
+            stored_count = len(segment['owners'])
+            pairs = np.unique(np.concatenate(query_rows) * stored_count + np.concatenate(stored_rows))
+            query_index, stored_index = np.divmod(pairs, stored_count)
+            distances = hamming_distances(query[query_index], segment['descriptors'][stored_index])
+            close = distances < match_distance
+            if not close.any():
+                continue
+
+            # One vote per (query descriptor, marker)
+            marker_count = len(segment['markers'])
+            owners = segment['owners'][stored_index[close]].astype(np.int64)
+            matched = np.unique(query_index[close] * marker_count + owners) % marker_count
+            marker_indices, counts = np.unique(matched, return_counts=True)
+
+            for marker_index, count in zip(marker_indices.tolist(), counts.tolist()):
+                marker = segment['markers'][marker_index]
+                if latest.get(marker['id']) != (segment_index, marker_index) or marker['id'] == exclude_id:
+                    continue
+                votes[marker['id']] = (count, marker)
+
+        ranked = sorted(votes.values(), key=lambda item: -item[0])[:limit]
+        return [{
+            'id': marker['id'],
+            'matches': count,
+            'score': round(count / len(query), 4),
+            'info': marker['info'],
+        } for count, marker in ranked]
+
+    def compact(self, min_segments=2):
+        """
+        Merge all segments into one, dropping replaced markers
+        Does nothing when there are fewer than min_segments segments.
+        """
+        with self._exclusive():
+            names = self._list_segments()
+            if len(names) < max(2, min_segments):
+                return
+
+            segments, latest = self._load()
+            descriptors, owners, meta = [], [], []
+            for segment_index, segment in enumerate(segments):
+                # Each marker's rows are one contiguous run, in marker order
+                ends = np.cumsum(np.bincount(segment['owners'], minlength=len(segment['markers'])))
+                starts = np.r_[0, ends[:-1]]
+                for marker_index, marker in enumerate(segment['markers']):
+                    if latest[marker['id']] != (segment_index, marker_index):
+                        continue
+                    start, end = int(starts[marker_index]), int(ends[marker_index])
+                    descriptors.append(np.asarray(segment['descriptors'][start:end]))
+                    owners.append(np.full(end - start, len(meta), dtype=np.uint32))
+                    meta.append(marker)
+
+            # Named after the newest merged segment so it sorts before any segment added meanwhile
+            merged_name = names[-1] + '-c'
+            self._write_segment(np.concatenate(descriptors), np.concatenate(owners), meta, merged_name)
+            for name in names:
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def compact_in_background(self):
+        """
+        Start compact() on a daemon thread once there are more than MAX_SEGMENTS segments
+        Returns whether a compaction was started.
+        """
+        if len(self._list_segments()) <= MAX_SEGMENTS:
+            return False
+        with self._lock:
+            if self._compacting:
+                return False
+            self._compacting = True
+
+        def run():
+            try:
+                # Rechecked under the file lock: another process may have compacted already
+                self.compact(min_segments=MAX_SEGMENTS + 1)
+            except Exception as e:
+                print(f"Descriptor index compaction error: {e}")
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name='descriptor-index-compact', daemon=True).start()
+        return True
+
+    def stats(self):
+        segments, latest = self._load()
+        return {
+            'markers': len(latest),
+            'segments': len(segments),
+            'descriptors': int(sum(len(segment['owners']) for segment in segments)),
+        }
+
+
+class _FileLock:
+    """
+    Exclusive flock on a file, across processes
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        return False
+
+
+def _write_json_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,112 @@
+"""
+Reusable OpenCV detector and CLAHE instances, and the feature detector engines.
+
+Creating ORB/CLAHE objects and running them for the first time has a
+noticeable one-off cost, so each thread keeps its own instances keyed by
+their parameters (OpenCV algorithm objects are not safe to share across
+threads).
+
+Feature extraction runs on one of three engines, fastest first:
+
+    fast    FAST corners on a single scale, described with unrotated
+            BRIEF-style tests (ORB's descriptor without orientation).
+            For live previews.
+    orb     ORB (oriented FAST, rotated BRIEF over an 8-level pyramid).
+            The default.
+    akaze   AKAZE (nonlinear scale space) with 256-bit MLDB descriptors.
+            Slowest and most repeatable, for final builds. Only in OpenCV
+            builds that ship it (4.x main modules; contrib in 5.x).
+
+All engines produce 32-byte binary descriptors, so their output fits the
+same .mind layouts. Descriptors of different engines do not match each
+other.
+"""
+
+import threading
+
+import cv2
+import numpy as np
+
+DETECTORS = ('fast', 'orb', 'akaze')
+DEFAULT_DETECTOR = 'orb'
+
+FAST_THRESHOLD = 20
+AKAZE_THRESHOLD = 0.001
+
+_local = threading.local()
+
+
+def _cached(key, factory):
+    cache = getattr(_local, 'instances', None)
+    if cache is None:
+        cache = _local.instances = {}
+    instance = cache.get(key)
+    if instance is None:
+        instance = cache[key] = factory()
+    return instance
+
+
+def get_orb(nfeatures=1000):
+    return _cached(('orb', nfeatures), lambda: cv2.ORB_create(nfeatures=nfeatures))
+
+
+def get_clahe(clip_limit=2.0, tile_grid=(8, 8)):
+    tile_grid = tuple(tile_grid)
+    return _cached(('clahe', clip_limit, tile_grid),
+                   lambda: cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid))
+
+
+def get_fast(threshold=20, nonmax_suppression=True):
+    return _cached(('fast', threshold, nonmax_suppression),
+                   lambda: cv2.FastFeatureDetector_create(threshold=threshold, nonmaxSuppression=nonmax_suppression))
+
+
+def get_akaze(threshold=AKAZE_THRESHOLD):
+    # descriptor_size is in bits; 256 keeps descriptors at 32 bytes like ORB
+    return _cached(('akaze', threshold),
+                   lambda: cv2.AKAZE_create(descriptor_size=256, threshold=threshold))
+
+
+def available_detectors():
+    """
+    Detector engines usable with this OpenCV build
+    """
+    return tuple(d for d in DETECTORS if d != 'akaze' or hasattr(cv2, 'AKAZE_create'))
+
+
+def _strongest(keypoints, descriptors, nfeatures):
+    if len(keypoints) <= nfeatures:
+        return keypoints, descriptors
+    responses = np.fromiter((kp.response for kp in keypoints), dtype=np.float32, count=len(keypoints))
+    keep = np.sort(np.argsort(-responses, kind='stable')[:nfeatures])
+    keypoints = tuple(keypoints[i] for i in keep)
+    return keypoints, descriptors[keep] if descriptors is not None else None
+
+
+def detect_features(gray, detector=DEFAULT_DETECTOR, nfeatures=1000, compute=True):
+    """
+    Detect (and describe, unless compute=False) at most nfeatures keypoints with an engine
+    Returns (keypoints, descriptors); descriptors is None when not computed or nothing was found
+    """
+    if detector == 'orb':
+        orb = get_orb(nfeatures)
+        if not compute:
+            return orb.detect(gray, None), None
+        return orb.detectAndCompute(gray, None)
+
+    if detector == 'fast':
+        keypoints, _ = _strongest(get_fast(FAST_THRESHOLD).detect(gray, None), None, nfeatures)
+        if not compute or not keypoints:
+            return keypoints, None
+        # FAST leaves angle unset, so ORB computes plain BRIEF-style tests
+        return get_orb(nfeatures).compute(gray, keypoints)
+
+    if detector == 'akaze':
+        if 'akaze' not in available_detectors():
+            raise ValueError("The akaze detector is not available in this OpenCV build")
+        akaze = get_akaze()
+        if not compute:
+            return _strongest(akaze.detect(gray, None), None, nfeatures)
+        return _strongest(*akaze.detectAndCompute(gray, None), nfeatures)
+
+    raise ValueError(f"Unknown detector: {detector}")
@@ -0,0 +1,158 @@
+"""
+Compact binary encoding for the feature data in basic .mind files.
+
+Layout (all integers little-endian):
+
+    header   16 bytes   magic b'MNDF', u16 version, u16 flags,
+                        u32 target_count, u32 body_size (uncompressed)
+    targets  16 bytes   per target: u32 width, u32 height,
+                        u32 feature_count, u32 descriptor_size
+    body                per target, in order:
+                        float32[feature_count][4] keypoints (x, y, angle, response)
+                        uint8[feature_count][descriptor_size] descriptors
+
+The body is optionally compressed as a whole (flags bit 0: zlib, bit 1:
+zstd). Flags bits 8-11 name the detector engine that produced the
+descriptors (0: orb, 1: fast, 2: akaze); descriptors of different engines
+are not comparable. Every section is a multiple of 4 bytes, so the float32 arrays stay
+aligned and can be read back with np.frombuffer without copying.
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b'MNDF'
+VERSION = 1
+
+FLAG_ZLIB = 0x1
+FLAG_ZSTD = 0x2
+
+COMPRESSIONS = ('none', 'zlib', 'zstd')
+
+# Detector engine codes stored in flags bits 8-11 (see detectors)
+DETECTOR_CODES = {'orb': 0, 'fast': 1, 'akaze': 2}
+DETECTOR_SHIFT = 8
+DETECTOR_MASK = 0xF << DETECTOR_SHIFT
+
+_HEADER = struct.Struct('<4sHHII')
+_TARGET = struct.Struct('<IIII')
+
+KEYPOINT_FIELDS = 4
+
+
+def available_compressions():
+    """
+    Compressions usable in this environment (zstd needs the optional zstandard package)
+    """
+    return tuple(c for c in COMPRESSIONS if c != 'zstd' or zstandard is not None)
+
+
+def pack_features(targets, compression='none', level=6):
+    """
+    Encode targets into the binary feature format
+
+    Each target is a dict with 'width', 'height', 'keypoints' (N x 4 float32),
+    'descriptors' (N x D uint8) and optionally 'detector' (default 'orb');
+    all targets of a file must share one detector.
+    """
+    if compression == 'zstd' and zstandard is None:
+        raise ValueError("zstd compression requires the 'zstandard' package")
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression: {compression}")
+
+    detectors = {target.get('detector', 'orb') for target in targets} or {'orb'}
+    if len(detectors) > 1:
+        raise ValueError("All targets in a feature file must use the same detector")
+    detector = detectors.pop()
+    if detector not in DETECTOR_CODES:
+        raise ValueError(f"Unknown detector: {detector}")
+
+    table = []
+    body = []
+    for target in targets:
+        keypoints = np.ascontiguousarray(target['keypoints'], dtype='<f4').reshape(-1, KEYPOINT_FIELDS)
+        descriptors = np.ascontiguousarray(target['descriptors'], dtype=np.uint8)
+        feature_count = len(keypoints)
+        descriptor_size = descriptors.shape[1] if descriptors.ndim == 2 and feature_count else 0
+        if descriptor_size % 4:
+            raise ValueError("Descriptor size must be a multiple of 4 bytes")
+
+        table.append(_TARGET.pack(target['width'], target['height'], feature_count, descriptor_size))
+        body.append(keypoints.tobytes())
+        body.append(descriptors.tobytes())
+
+    body = b''.join(body)
+    body_size = len(body)
+    flags = DETECTOR_CODES[detector] << DETECTOR_SHIFT
+
+    if compression == 'zlib':
+        body = zlib.compress(body, level)
+        flags |= FLAG_ZLIB
+    elif compression == 'zstd':
+        body = zstandard.ZstdCompressor(level=level).compress(body)
+        flags |= FLAG_ZSTD
+
+    header = _HEADER.pack(MAGIC, VERSION, flags, len(table), body_size)
+    return b''.join([header] + table + [body])
+
+
+def unpack_features(data):
+    """
+    Decode the binary feature format into a list of target dicts
+
+    Arrays are views into data (or into the decompressed body), not copies.
+    """
+    view = memoryview(data)
+    magic, version, flags, target_count, body_size = _HEADER.unpack_from(view, 0)
+
+    if magic != MAGIC:
+        raise ValueError("Not a binary feature file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported feature format version: {version}")
+
+    offset = _HEADER.size
+    table = []
+    for _ in range(target_count):
+        table.append(_TARGET.unpack_from(view, offset))
+        offset += _TARGET.size
+
+    body = view[offset:]
+    if flags & FLAG_ZLIB:
+        body = memoryview(zlib.decompress(body))
+    elif flags & FLAG_ZSTD:
+        if zstandard is None:
+            raise ValueError("zstd compressed file requires the 'zstandard' package")
+        body = memoryview(zstandard.ZstdDecompressor().decompress(body, max_output_size=body_size))
+
+    if len(body) != body_size:
+        raise ValueError("Feature body size does not match header")
+
+    detector_code = (flags & DETECTOR_MASK) >> DETECTOR_SHIFT
+    detector = next((name for name, code in DETECTOR_CODES.items() if code == detector_code), None)
+    if detector is None:
+        raise ValueError(f"Unknown detector code: {detector_code}")
+
+    targets = []
+    offset = 0
+    for width, height, feature_count, descriptor_size in table:
+        keypoints = np.frombuffer(body, dtype='<f4', count=feature_count * KEYPOINT_FIELDS, offset=offset)
+        offset += keypoints.nbytes
+        descriptors = np.frombuffer(body, dtype=np.uint8, count=feature_count * descriptor_size, offset=offset)
+        offset += descriptors.nbytes
+
+        targets.append({
+            'width': width,
+            'height': height,
+            'keypoints': keypoints.reshape(feature_count, KEYPOINT_FIELDS),
+            'descriptors': descriptors.reshape(feature_count, descriptor_size),
+            'detector': detector,
+        })
+
+    return targets
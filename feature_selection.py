@@ -0,0 +1,53 @@
+"""
+Spatially balanced feature selection shared by the Flask service and the CLI.
+
+ORB returns its keypoints in detection order, and the strongest ones
+cluster on the most textured part of a marker. Trackers need points
+spread over the whole target, so selection buckets keypoints into a grid
+and takes them round-robin across cells: every cell's strongest point,
+then every cell's second strongest, and so on until the budget is spent.
+Empty cells give their share to busier ones, and the result is ordered
+so that any prefix of it is balanced too.
+"""
+
+import numpy as np
+
+FEATURE_GRID = (8, 8)  # columns, rows
+
+
+def keypoint_array(keypoints):
+    """
+    cv2.KeyPoint list as a float32 (N, 4) array of x, y, angle, response
+    Arrays already in that layout are returned as they are
+    """
+    if isinstance(keypoints, np.ndarray):
+        return keypoints.astype(np.float32, copy=False).reshape(-1, 4)
+    return np.array([(kp.pt[0], kp.pt[1], kp.angle, kp.response) for kp in keypoints or ()],
+                    dtype=np.float32).reshape(-1, 4)
+
+
+def select_features(points, responses, width, height, budget, grid=FEATURE_GRID):
+    """
+    Indices of at most budget features, balanced over a grid and strongest first per cell
+    points is an (N, 2) array of x, y in pixels of a width x height image
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    responses = np.asarray(responses, dtype=np.float32)
+    count = len(responses)
+    if count == 0 or budget <= 0:
+        return np.zeros(0, dtype=np.intp)
+
+    columns, rows = grid
+    cx = np.clip((points[:, 0] * (columns / width)).astype(np.intp), 0, columns - 1)
+    cy = np.clip((points[:, 1] * (rows / height)).astype(np.intp), 0, rows - 1)
+    cells = cy * columns + cx
+
+    # Group by cell, strongest first within each cell
+    order = np.lexsort((-responses, cells))
+    sorted_cells = cells[order]
+    starts = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    rank = np.arange(count) - np.repeat(starts, np.diff(np.r_[starts, count]))
+
+    # Round-robin over cells: rank 0 of every cell (strongest first), then rank 1, ...
+    picked = np.lexsort((-responses[order], rank))[:budget]
+    return order[picked]
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for the MindAR compiler service.
+
+Gunicorn loads this file automatically from the working directory, so the
+Procfile command (gunicorn app:app --bind 0.0.0.0:$PORT) picks it up.
+
+Workers are threaded so each one serves several requests at once; the
+admission controller's megapixel budget and priority lane then decide
+which of them run (see admission). The app keeps OpenCV detectors and
+scratch buffers per thread.
+"""
+
+import os
+
+worker_class = 'gthread'
+threads = int(os.environ.get('MINDAR_SERVER_THREADS', 4))
+
+
+def on_starting(server):
+    """
+    Export the worker count before forking: each worker sizes its job
+    process pool to its share of the cores (job_queue.default_pool_size)
+    """
+    os.environ['MINDAR_SERVER_WORKERS'] = str(server.cfg.workers)
+
+
+def post_worker_init(worker):
+    """
+    Prewarm each worker after fork, before it accepts requests
+    """
+    if os.environ.get('MINDAR_PREWARM', '1') == '0':
+        return
+
+    from app import prewarm
+    prewarm()
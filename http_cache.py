@@ -0,0 +1,121 @@
+"""
+HTTP caching and compressed transport for .mind responses.
+
+Every .mind response carries a strong ETag derived from the SHA-256 of its
+bytes, so a client or CDN that revalidates with If-None-Match gets a bodyless
+304 instead of the file. Clients that accept it get the body gzip or brotli
+(optional 'brotli' package) encoded. Each encoded variant is stored in a
+content-addressed store (the compile cache, shared by all workers) under
+the content hash, so a given file is compressed once, not once per
+download. Variants get their own ETag suffix, as strong ETags must differ
+between representations.
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Preferred first when the client accepts several equally
+ENCODINGS = ('br', 'gzip', 'identity')
+
+
+def available_encodings():
+    """
+    Content encodings usable in this environment (br needs the optional brotli package)
+    """
+    return tuple(e for e in ENCODINGS if e != 'br' or brotli is not None)
+
+
+def content_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def encode(data, encoding, gzip_level=6, brotli_quality=9):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output (and with it the variant ETag) deterministic
+        return gzip.compress(data, gzip_level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+class HttpCache:
+    """
+    ETags and stored compressed variants for response bodies
+    """
+
+    def __init__(self, store=None, min_compress_bytes=1024, max_age=0, gzip_level=6, brotli_quality=9):
+        self.store = store
+        self.min_compress_bytes = min_compress_bytes
+        self.max_age = max_age
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+        self._lock = threading.Lock()
+        self._counters = {'notModified': 0, 'compressed': 0, 'variantHits': 0, 'bytesSaved': 0}
+
+    @classmethod
+    def from_env(cls, store=None):
+        """
+        Create an HttpCache configured from MINDAR_HTTP_* environment variables
+        """
+        return cls(
+            store=store,
+            min_compress_bytes=int(os.environ.get('MINDAR_HTTP_MIN_COMPRESS_BYTES', 1024)),
+            max_age=int(os.environ.get('MINDAR_HTTP_MAX_AGE', 0)),
+            gzip_level=int(os.environ.get('MINDAR_HTTP_GZIP_LEVEL', 6)),
+            brotli_quality=int(os.environ.get('MINDAR_HTTP_BROTLI_QUALITY', 9)),
+        )
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def etag(self, digest, encoding='identity'):
+        """
+        Strong ETag value (unquoted) of the given representation of a body
+        """
+        return digest if encoding == 'identity' else f"{digest}-{encoding}"
+
+    def not_modified(self):
+        self._count('notModified')
+
+    def variant(self, data, digest, encoding):
+        """
+        data in the given content encoding, compressed at most once per store
+        Returns (body, encoding); falls back to identity when encoding would not pay off
+        """
+        if encoding == 'identity' or len(data) < self.min_compress_bytes:
+            return data, 'identity'
+
+        key = f"{digest}-{encoding}"
+        body = self.store.get(key) if self.store is not None else None
+        if body is not None:
+            self._count('variantHits')
+        else:
+            body = encode(data, encoding, self.gzip_level, self.brotli_quality)
+            self._count('compressed')
+            if self.store is not None:
+                self.store.put(key, body)
+
+        # Already compressed payloads (zlib/zstd .mind bodies) do not shrink
+        if len(body) >= len(data):
+            return data, 'identity'
+        self._count('bytesSaved', len(data) - len(body))
+        return body, encoding
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+        stats.update(
+            encodings=list(available_encodings()),
+            minCompressBytes=self.min_compress_bytes,
+            maxAge=self.max_age,
+        )
+        return stats
@@ -0,0 +1,150 @@
+"""
+Image header sniffing and reduced-resolution decoding shared by the
+Flask service and the CLI compiler.
+
+Phone photos are 12-48 MP but the compile pipeline only needs ~512 px, so
+we read the dimensions from the header first and let libjpeg decode
+straight at 1/2, 1/4 or 1/8 scale instead of decoding everything and
+throwing most of it away.
+"""
+
+import struct
+
+import cv2
+import numpy as np
+
+# (scale, color flag, grayscale flag), largest reduction first
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# JPEG start-of-frame markers that carry the frame dimensions
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def sniff_format(head):
+    """
+    Identify the image format from its first bytes ('jpeg', 'png', ...) or None
+    """
+    head = bytes(head[:16])
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'gif'
+    if head.startswith(b'BM'):
+        return 'bmp'
+    return None
+
+
+def read_image_header(data):
+    """
+    Read (format, width, height) from the image header without decoding pixels
+
+    Returns None if the format is unknown or the header is truncated.
+    """
+    data = memoryview(data)
+    fmt = sniff_format(data)
+
+    try:
+        if fmt == 'png':
+            width, height = struct.unpack('>II', data[16:24])
+            return fmt, width, height
+
+        if fmt == 'gif':
+            width, height = struct.unpack('<HH', data[6:10])
+            return fmt, width, height
+
+        if fmt == 'bmp':
+            width, height = struct.unpack('<ii', data[18:26])
+            return fmt, width, abs(height)
+
+        if fmt == 'webp':
+            chunk = bytes(data[12:16])
+            if chunk == b'VP8X':
+                width = int.from_bytes(data[24:27], 'little') + 1
+                height = int.from_bytes(data[27:30], 'little') + 1
+                return fmt, width, height
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', data[26:30])
+                return fmt, width & 0x3FFF, height & 0x3FFF
+            if chunk == b'VP8L':
+                bits = int.from_bytes(data[21:25], 'little')
+                return fmt, (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            return None
+
+        if fmt == 'jpeg':
+            offset = 2
+            while offset + 4 <= len(data):
+                if data[offset] != 0xFF:
+                    offset += 1
+                    continue
+                marker = data[offset + 1]
+                if marker == 0xFF:
+                    offset += 1
+                    continue
+                if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                    offset += 2
+                    continue
+                length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+                if marker in _JPEG_SOF_MARKERS:
+                    height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+                    return fmt, width, height
+                offset += 2 + length
+            return None
+
+    except struct.error:
+        return None
+
+    return None
+
+
+def reduced_decode_scale(width, height, target_size):
+    """
+    Largest libjpeg scale (8, 4, 2 or 1) that keeps the longest side >= target_size
+    """
+    longest = max(width, height)
+    for scale, _, _ in REDUCED_DECODE_FLAGS:
+        if longest // scale >= target_size:
+            return scale
+    return 1
+
+
+def decode_image_reduced(image_data, target_size=None, grayscale=False):
+    """
+    Decode image bytes, using libjpeg's reduced-size decode when the image is
+    much larger than target_size. The result is never smaller than
+    target_size on its longest side (unless the source is), so callers still
+    finish with their own small resize.
+
+    Returns (img, (original_width, original_height)). Raises ValueError if
+    the bytes cannot be decoded.
+    """
+    nparr = np.frombuffer(image_data, np.uint8)
+    header = read_image_header(nparr) if target_size else None
+
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    if header is not None:
+        _, width, height = header
+        scale = reduced_decode_scale(width, height, target_size)
+        for candidate, color_flag, gray_flag in REDUCED_DECODE_FLAGS:
+            if candidate == scale:
+                flag = gray_flag if grayscale else color_flag
+
+    img = cv2.imdecode(nparr, flag)
+
+    if img is None:
+        raise ValueError("Could not decode image")
+
+    if header is None:
+        height, width = img.shape[:2]
+    elif img.shape[0] > img.shape[1] and width > height or img.shape[1] > img.shape[0] and height > width:
+        # EXIF orientation was applied on decode; report the displayed orientation
+        width, height = height, width
+
+    return img, (width, height)
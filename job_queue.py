@@ -0,0 +1,301 @@
+"""
+Background compile jobs for the Flask service.
+
+Jobs run on a per-worker ProcessPoolExecutor so CPU-bound OpenCV work
+spreads across cores while the request thread returns immediately. Each
+gunicorn worker's pool gets its share of the host's cores (see
+default_pool_size), so W workers never start W x cores processes. Job
+status and results are written to a directory shared by all gunicorn
+workers, so GET /jobs/<id> works no matter which worker receives it.
+If a pool process dies, its jobs are marked failed and the next job
+starts a new pool.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+DEFAULT_JOBS_DIR = os.path.join(tempfile.gettempdir(), 'mindar-jobs')
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a worker already has max_queue jobs outstanding
+    """
+
+
+def _write_json_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _init_pool_worker():
+    # Each pool process gets one core; let the pool provide the parallelism
+    try:
+        import cv2
+        cv2.setNumThreads(1)
+    except ImportError:
+        pass
+
+
+def default_pool_size():
+    """
+    Pool processes per service worker: the host's cores split evenly between the
+    MINDAR_SERVER_WORKERS gunicorn workers (exported by gunicorn.conf.py), at least one
+    """
+    server_workers = max(1, int(os.environ.get('MINDAR_SERVER_WORKERS', 1)))
+    return max(1, (os.cpu_count() or 1) // server_workers)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _run_job(jobs_dir, job_id, record, job_ttl, fn, args, inputs=()):
+    """
+    Execute fn(*args) in a pool process and persist its status and result
+
+    fn must return (meta, payload) where meta is JSON-serializable and
+    payload is bytes, the path of a finished result file on the same
+    filesystem as jobs_dir (moved into place, never read into memory), or None.
+    inputs are files fn would have deleted; they are removed if it never runs.
+    """
+    status_path = os.path.join(jobs_dir, job_id + '.json')
+    now = time.time()
+
+    if now - record['createdAt'] > job_ttl:
+        _remove_files(inputs)
+        record.update(status='expired', finishedAt=now, error='Job waited longer than its TTL')
+        _write_json_atomic(status_path, record)
+        return record
+
+    record.update(status='running', startedAt=now)
+    _write_json_atomic(status_path, record)
+
+    try:
+        meta, payload = fn(*args)
+        result_path = os.path.join(jobs_dir, job_id + '.bin')
+        result_size = 0
+        if isinstance(payload, str):
+            os.replace(payload, result_path)
+            result_size = os.path.getsize(result_path)
+        elif payload is not None:
+            with open(result_path, 'wb') as f:
+                f.write(payload)
+            result_size = len(payload)
+        record.update(status='completed', result=meta, resultSize=result_size)
+    except Exception as e:
+        record.update(status='failed', error=str(e))
+
+    record['finishedAt'] = time.time()
+    _write_json_atomic(status_path, record)
+    return record
+
+
+class JobManager:
+    """
+    Bounded queue of background jobs with TTL and result retention
+    """
+
+    def __init__(self, jobs_dir=None, max_workers=None, max_queue=None,
+                 job_ttl=300, result_retention=3600, sweep_interval=30):
+        self.jobs_dir = jobs_dir or DEFAULT_JOBS_DIR
+        self.max_workers = max_workers or default_pool_size()
+        self.max_queue = max_queue or self.max_workers * 4
+        self.job_ttl = job_ttl
+        self.result_retention = result_retention
+        self.sweep_interval = sweep_interval
+
+        self._executor = None
+        self._executor_pid = None
+        self._futures = {}  # job_id -> (future, record)
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._counters = {'submitted': 0, 'rejected': 0, 'completed': 0, 'failed': 0, 'expired': 0}
+
+        os.makedirs(self.jobs_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create a manager configured from MINDAR_JOB_* environment variables
+        """
+        return cls(
+            jobs_dir=os.environ.get('MINDAR_JOBS_DIR') or None,
+            max_workers=int(os.environ.get('MINDAR_JOB_WORKERS', 0)) or None,
+            max_queue=int(os.environ.get('MINDAR_JOB_QUEUE_DEPTH', 0)) or None,
+            job_ttl=int(os.environ.get('MINDAR_JOB_TTL', 300)),
+            result_retention=int(os.environ.get('MINDAR_JOB_RETENTION', 3600)),
+        )
+
+    def executor(self):
+        """
+        Process pool for this worker, created lazily so it is never inherited across a fork
+        """
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_pool_worker)
+                self._executor_pid = os.getpid()
+                self._futures = {}
+            return self._executor
+
+    def discard_executor(self, executor):
+        """
+        Forget a pool broken by a dying process (OOM, crash in native code)
+        The next executor() call starts a new pool.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def _status_path(self, job_id):
+        return os.path.join(self.jobs_dir, job_id + '.json')
+
+    def result_path(self, job_id):
+        return os.path.join(self.jobs_dir, job_id + '.bin')
+
+    def outstanding(self):
+        with self._lock:
+            return sum(1 for future, _ in self._futures.values() if not future.done())
+
+    def submit(self, fn, *args, kind='compile', on_done=None, inputs=(), **info):
+        """
+        Queue fn(*args) and return the initial job record
+
+        on_done(future) is called once the job finishes, fails or is cancelled.
+        inputs are files owned by the job (e.g. a spooled upload) that fn deletes
+        when it runs; they are deleted here if the job expires or is cancelled first.
+        Raises QueueFullError when this worker already has max_queue jobs outstanding.
+        """
+        self.sweep()
+
+        if self.outstanding() >= self.max_queue:
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise QueueFullError(f"Job queue is full ({self.max_queue} outstanding)")
+
+        job_id = uuid.uuid4().hex
+        record = dict(info, id=job_id, kind=kind, status='queued', createdAt=time.time())
+        _write_json_atomic(self._status_path(job_id), record)
+
+        inputs = tuple(inputs)
+        for attempt in range(2):
+            executor = self.executor()
+            try:
+                future = executor.submit(_run_job, self.jobs_dir, job_id, dict(record), self.job_ttl, fn, args, inputs)
+                break
+            except BrokenProcessPool as e:
+                self.discard_executor(executor)
+                if attempt:
+                    record.update(status='failed', finishedAt=time.time(), error=f"Job pool unavailable: {e}")
+                    _write_json_atomic(self._status_path(job_id), record)
+                    raise
+        future.add_done_callback(partial(self._on_done, job_id, record, executor))
+        if inputs:
+            future.add_done_callback(lambda future: future.cancelled() and _remove_files(inputs))
+        if on_done is not None:
+            future.add_done_callback(on_done)
+
+        with self._lock:
+            self._futures[job_id] = (future, record)
+            self._counters['submitted'] += 1
+
+        return record
+
+    def complete(self, meta, payload, kind='compile', **info):
+        """
+        Record an already finished job (e.g. a compile cache hit) without using the pool
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        if payload is not None:
+            with open(self.result_path(job_id), 'wb') as f:
+                f.write(payload)
+        record = dict(info, id=job_id, kind=kind, status='completed', createdAt=now, finishedAt=now,
+                      result=meta, resultSize=len(payload) if payload is not None else 0)
+        _write_json_atomic(self._status_path(job_id), record)
+        with self._lock:
+            self._counters['submitted'] += 1
+            self._counters['completed'] += 1
+        return record
+
+    def _on_done(self, job_id, record, executor, future):
+        if future.cancelled():
+            return
+        try:
+            status = future.result()['status']
+        except Exception as e:
+            # _run_job never got to write its final status (e.g. the pool process died)
+            status = 'failed'
+            if isinstance(e, BrokenProcessPool):
+                self.discard_executor(executor)
+            _write_json_atomic(self._status_path(job_id),
+                               dict(record, status='failed', finishedAt=time.time(), error=f"Job process failed: {e}"))
+        with self._lock:
+            if status in self._counters:
+                self._counters[status] += 1
+
+    def get(self, job_id):
+        """
+        Current job record, or None if unknown or already swept
+        """
+        self.sweep()
+        try:
+            with open(self._status_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def sweep(self, force=False):
+        """
+        Expire jobs queued past their TTL and delete results past retention
+        """
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+            tracked = list(self._futures.items())
+
+        for job_id, (future, record) in tracked:
+            if future.done():
+                with self._lock:
+                    self._futures.pop(job_id, None)
+            elif now - record['createdAt'] > self.job_ttl and future.cancel():
+                record.update(status='expired', finishedAt=now, error='Job waited longer than its TTL')
+                _write_json_atomic(self._status_path(job_id), record)
+                with self._lock:
+                    self._futures.pop(job_id, None)
+                    self._counters['expired'] += 1
+
+        # Files are rewritten on every state change, so anything untouched for
+        # longer than TTL + retention is a finished job past its retention window
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if now - os.path.getmtime(path) > self.result_retention + self.job_ttl:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        counters.update(
+            outstanding=self.outstanding(),
+            maxQueue=self.max_queue,
+            workers=self.max_workers,
+        )
+        return counters
@@ -0,0 +1,316 @@
+"""
+Prometheus-style metrics for the compile pipeline.
+
+Every process (gunicorn worker or job pool process) keeps its own
+counters and histograms and periodically writes a snapshot to a shared
+directory; /metrics merges the snapshots of all processes so the numbers
+are aggregated across workers. Snapshots of exited processes are folded
+into one aggregate file and deleted, so counters never go backwards and the
+directory does not grow with worker restarts; their gauges are dropped. A
+process whose pid was reused folds the leftover snapshot under that pid
+before writing its own.
+
+stage() also records per-request timings for the Server-Timing header.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'mindar-metrics')
+
+FLUSH_INTERVAL = 1.0
+# Counters and histograms of exited processes; the lock file serializes folding
+EXITED_SNAPSHOT = 'exited.json'
+LOCK_FILE = 'metrics.lock'
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MEGAPIXEL_BUCKETS = (0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 48, 100)
+BYTES_BUCKETS = (1024, 4096, 16384, 32768, 65536, 131072, 262144, 524288, 1048576, 4194304)
+FEATURE_BUCKETS = (0, 50, 100, 250, 500, 750, 1000, 2000)
+FRAME_BUCKETS = (30, 60, 150, 300, 600, 900, 1800, 3600, 9000)
+
+# name -> (type, help, buckets)
+METRICS = {
+    'mindar_stage_duration_seconds': ('histogram', 'Time spent per compile pipeline stage', DURATION_BUCKETS),
+    'mindar_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint', DURATION_BUCKETS),
+    'mindar_input_megapixels': ('histogram', 'Original size of decoded input images', MEGAPIXEL_BUCKETS),
+    'mindar_output_bytes': ('histogram', 'Size of compiled .mind payloads', BYTES_BUCKETS),
+    'mindar_feature_count': ('histogram', 'Features detected per compiled target', FEATURE_BUCKETS),
+    'mindar_video_frames': ('histogram', 'Frames written per prepared video', FRAME_BUCKETS),
+    'mindar_requests_total': ('counter', 'HTTP requests by endpoint and status', None),
+    'mindar_errors_total': ('counter', 'Failed requests by reason', None),
+    'mindar_in_flight_requests': ('gauge', 'Requests currently being handled', None),
+}
+
+_lock = threading.Lock()
+_values = {name: {} for name in METRICS}  # name -> {labels_json: value or [buckets..., sum, count]}
+_local = threading.local()
+_last_flush = 0.0
+_owns_snapshot = False
+_metrics_dir = os.environ.get('MINDAR_METRICS_DIR') or DEFAULT_METRICS_DIR
+
+
+def _labels_key(labels):
+    return json.dumps(labels or {}, sort_keys=True)
+
+
+def observe(name, value, **labels):
+    """
+    Record value in histogram name
+    """
+    buckets = METRICS[name][2]
+    key = _labels_key(labels)
+    with _lock:
+        series = _values[name].get(key)
+        if series is None:
+            series = _values[name][key] = [0] * len(buckets) + [0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+    _maybe_flush()
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increment counter or gauge name
+    """
+    key = _labels_key(labels)
+    with _lock:
+        _values[name][key] = _values[name].get(key, 0) + amount
+    _maybe_flush()
+
+
+def dec(name, amount=1, **labels):
+    inc(name, -amount, **labels)
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage into the stage histogram and the current request's timings
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        observe('mindar_stage_duration_seconds', elapsed, stage=name)
+        timings = getattr(_local, 'timings', None)
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def begin_request():
+    _local.timings = []
+
+
+def end_request():
+    """
+    Stage timings recorded on this thread since begin_request, as (name, seconds)
+    """
+    timings = getattr(_local, 'timings', None) or []
+    _local.timings = None
+    return timings
+
+
+def server_timing_header(timings, total=None):
+    """
+    Format stage timings as a Server-Timing header value (durations in ms)
+    """
+    merged = {}
+    for name, elapsed in timings:
+        merged[name] = merged.get(name, 0.0) + elapsed
+    parts = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in merged.items()]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+def _snapshot_path(pid=None):
+    return os.path.join(_metrics_dir, f"{pid or os.getpid()}.json")
+
+
+def _maybe_flush():
+    if time.time() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+@contextmanager
+def _dir_lock():
+    os.makedirs(_metrics_dir, exist_ok=True)
+    with open(os.path.join(_metrics_dir, LOCK_FILE), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def flush():
+    """
+    Write this process's snapshot to the shared metrics directory
+    """
+    global _last_flush, _owns_snapshot
+    with _lock:
+        _last_flush = time.time()
+        data = json.dumps(_values)
+    try:
+        if not _owns_snapshot:
+            # Anything under our pid was written by an exited process
+            with _dir_lock():
+                _fold_exited([os.getpid()])
+            _owns_snapshot = True
+        fd, tmp_path = tempfile.mkstemp(dir=_metrics_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, _snapshot_path())
+    except OSError as e:
+        print(f"Metrics flush error: {e}")
+
+
+atexit.register(flush)
+
+
+def _reset_after_fork():
+    # A forked child (pool process, gunicorn worker) starts from zero under its
+    # own pid; inheriting the parent's values would count them twice
+    global _lock, _values, _local, _last_flush, _owns_snapshot
+    _lock = threading.Lock()
+    _values = {name: {} for name in METRICS}
+    _local = threading.local()
+    _last_flush = 0.0
+    _owns_snapshot = False
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def _merge(merged, snapshot, gauges=True):
+    for name, series in snapshot.items():
+        if name not in METRICS:
+            continue
+        kind = METRICS[name][0]
+        if kind == 'gauge' and not gauges:
+            continue
+        target = merged.setdefault(name, {})
+        for key, value in series.items():
+            if kind == 'histogram':
+                existing = target.get(key)
+                target[key] = value if existing is None else [a + b for a, b in zip(existing, value)]
+            else:
+                target[key] = target.get(key, 0) + value
+
+
+def _snapshot_pids():
+    try:
+        names = os.listdir(_metrics_dir)
+    except OSError:
+        return []
+    pids = []
+    for filename in names:
+        if filename.endswith('.json') and filename[:-5].isdigit():
+            pids.append(int(filename[:-5]))
+    return pids
+
+
+def _fold_exited(pids):
+    """
+    Add the snapshots of the given (exited) pids to the exited aggregate and delete them
+    Call with _dir_lock held
+    """
+    snapshots = [(pid, _read_snapshot(_snapshot_path(pid))) for pid in pids]
+    snapshots = [(pid, snapshot) for pid, snapshot in snapshots if snapshot is not None]
+    if not snapshots:
+        return
+
+    exited_path = os.path.join(_metrics_dir, EXITED_SNAPSHOT)
+    exited = _read_snapshot(exited_path) or {}
+    for _, snapshot in snapshots:
+        _merge(exited, snapshot, gauges=False)
+
+    fd, tmp_path = tempfile.mkstemp(dir=_metrics_dir, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(exited, f)
+    os.replace(tmp_path, exited_path)
+    for pid, _ in snapshots:
+        os.remove(_snapshot_path(pid))
+
+
+def collect():
+    """
+    Merge the snapshots of all processes into {name: {labels_json: value}}
+    Snapshots of exited processes are folded into the exited aggregate first
+    """
+    flush()
+    merged = {name: {} for name in METRICS}
+
+    try:
+        with _dir_lock():
+            pids = _snapshot_pids()
+            _fold_exited([pid for pid in pids if pid != os.getpid() and not _pid_alive(pid)])
+
+            for path in [os.path.join(_metrics_dir, EXITED_SNAPSHOT)] + [_snapshot_path(pid) for pid in _snapshot_pids()]:
+                snapshot = _read_snapshot(path)
+                if snapshot is not None:
+                    _merge(merged, snapshot)
+    except OSError as e:
+        print(f"Metrics collect error: {e}")
+
+    return merged
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in items]
+    return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+
+def render():
+    """
+    All metrics in Prometheus text exposition format
+    """
+    lines = []
+    for name, series in collect().items():
+        kind, help_text, buckets = METRICS[name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in sorted(series):
+            labels = json.loads(key)
+            value = series[key]
+            if kind == 'histogram':
+                for bound, count in zip(buckets, value):
+                    lines.append(f"{name}_bucket{_format_labels(labels, {'le': repr(float(bound))})} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
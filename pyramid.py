@@ -0,0 +1,80 @@
+"""
+Multi-scale feature pyramids for .mind targets.
+
+A target compiled at one resolution only tracks while the marker covers
+roughly that many pixels of the camera frame; once it is far away, none of
+its features are found at the scale they were recorded at. Targets
+therefore carry several levels: the processed image itself plus
+successively smaller copies, each with its own feature set.
+
+The pyramid is built once per target from the decoded grayscale image (at
+up to validation resolution, so the finest level is finer than the
+single-scale compile image), enhanced once; each level is resized from the
+previous one, so no level decodes or enhances again. Detection on the levels runs on a shared
+thread pool; OpenCV releases the GIL and detectors are per thread (see
+detectors), so levels run in parallel on multi-core machines.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from detectors import detect_features
+
+# Levels per target, including the full-size one, and the size ratio between levels
+PYRAMID_LEVELS = 3
+PYRAMID_SCALE = 0.5
+# Levels whose shorter side would drop below this are not built
+MIN_LEVEL_SIZE = 96
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=min(PYRAMID_LEVELS, os.cpu_count() or 1),
+                                           thread_name_prefix='pyramid')
+        return _executor
+
+
+def build_pyramid(gray, levels=PYRAMID_LEVELS, scale=PYRAMID_SCALE, min_size=MIN_LEVEL_SIZE):
+    """
+    gray followed by up to levels - 1 copies, each scale times the size of the previous one
+    """
+    pyramid = [gray]
+    while len(pyramid) < levels:
+        height, width = pyramid[-1].shape[:2]
+        size = (round(width * scale), round(height * scale))
+        if min(size) < min_size:
+            break
+        pyramid.append(cv2.resize(pyramid[-1], size, interpolation=cv2.INTER_AREA))
+    return pyramid
+
+
+def detect_pyramid(pyramid, detector, nfeatures, base_features=None):
+    """
+    (keypoints, descriptors) for every pyramid level, detected in parallel
+    Pass base_features to reuse an earlier extraction on level 0
+    """
+    levels = pyramid[1:] if base_features is not None else pyramid
+    if len(levels) > 1:
+        futures = [_get_executor().submit(detect_features, level, detector, nfeatures) for level in levels]
+        features = [future.result() for future in futures]
+    else:
+        features = [detect_features(level, detector, nfeatures) for level in levels]
+    return [base_features] + features if base_features is not None else features
+
+
+def _reset_after_fork():
+    # Worker threads do not survive fork; children start their own pool on first use
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
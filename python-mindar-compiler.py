@@ -4,136 +4,181 @@ MindAR Compiler - Standalone Python Script
 This script converts images to proper .mind files for MindAR tracking.
 """
 
+import argparse
+import csv
 import cv2
-import numpy as np
+import hashlib
 import json
+import numpy as np
 import sys
 import os
-import requests
 import struct
-from PIL import Image
-import io
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+
+from descriptor_index import MAX_SEGMENTS, DescriptorIndex, select_descriptors
+from detectors import DEFAULT_DETECTOR, available_detectors
+from feature_selection import keypoint_array, select_features
+from pyramid import build_pyramid, detect_pyramid
+from target_compiler import (CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, MAX_IMAGE_SIZE, ORB_FEATURES, compile_target,
+                             enhance_gray_for_mindar, extract_features, process_image, validate_target)
+
+# Feature points written per target (--features) and detector engine
+# (--detector: fast, orb or akaze; see detectors). Read from the environment
+# so pool worker processes pick them up too
+FEATURE_BUDGET = int(os.environ.get('MINDAR_FEATURE_BUDGET', 100))
+DETECTOR = os.environ.get('MINDAR_DETECTOR', DEFAULT_DETECTOR)
+# Pyramid levels per target (--levels, see pyramid). 1 writes the original
+# single-scale version 1 layout; more levels opt in to the version 2 layout,
+# which readers of version 1 files cannot parse
+PYRAMID_LEVELS = int(os.environ.get('MINDAR_PYRAMID_LEVELS', 1))
+
+# Manifest batch downloads
+DOWNLOAD_TIMEOUT = 30
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_WORKERS = 8
+
+# Incremental directory builds
+# Bump COMPILER_VERSION whenever a change alters the generated .mind bytes
+COMPILER_VERSION = 5
+BUILD_MANIFEST_NAME = '.mindar-build.json'
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
 
 def process_image_for_mindar(image_data):
     """
     Process image to be optimal for MindAR tracking
     """
     try:
-        # Convert bytes to numpy array
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            raise ValueError("Could not decode image")
-        
-        # Resize to optimal dimensions (power of 2, max 512x512 for performance)
-        height, width = img.shape[:2]
-        max_size = 512
-        
-        if max(height, width) > max_size:
-            if width > height:
-                new_width = max_size
-                new_height = int(height * (max_size / width))
-            else:
-                new_height = max_size
-                new_width = int(width * (max_size / height))
-            
-            img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
-        
-        # Enhance contrast and sharpness
-        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        
-        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        
-        img = cv2.merge([l, a, b])
-        img = cv2.cvtColor(img, cv2.COLOR_LAB2BGR)
-        
-        # Sharpen the image
-        kernel = np.array([[-1,-1,-1],
-                          [-1, 9,-1],
-                          [-1,-1,-1]])
-        img = cv2.filter2D(img, -1, kernel)
-        
-        return img
-        
+        return process_image(image_data, {'preprocess': 'color'})
     except Exception as e:
         print(f"Image processing error: {e}")
         return None
 
-def create_mindar_file(processed_image):
+def set_compile_options(feature_budget=None, detector=None, levels=None):
+    """
+    Feature budget, detector and pyramid levels for this process and worker processes started later
+    """
+    global FEATURE_BUDGET, DETECTOR, PYRAMID_LEVELS
+    if feature_budget is not None:
+        FEATURE_BUDGET = feature_budget
+        os.environ['MINDAR_FEATURE_BUDGET'] = str(feature_budget)
+    if detector is not None:
+        DETECTOR = detector
+        os.environ['MINDAR_DETECTOR'] = detector
+    if levels is not None:
+        PYRAMID_LEVELS = levels
+        os.environ['MINDAR_PYRAMID_LEVELS'] = str(levels)
+
+def select_feature_points(keypoints, width, height, budget=None):
+    """
+    Spatially balanced feature points as a float32 (N, 2) array of x, y in 0..1
+    """
+    keypoints = keypoint_array(keypoints)
+    selected = select_features(keypoints[:, :2], keypoints[:, 3], width, height, budget or FEATURE_BUDGET)
+    return keypoints[selected, :2] / np.array([width, height], dtype=np.float32)
+
+def detect_target_levels(gray, keypoints, descriptors, source=None):
+    """
+    Feature points of every pyramid level of a target, as (width, height, points) tuples
+    keypoints and descriptors are the extraction on gray, the processed compile image.
+    With more than one level the pyramid starts at source, the decoded grayscale
+    image (enhanced here), when it is larger than gray, so the finest level keeps
+    detail the compile image lost; a level the size of gray (within rounding) is
+    gray itself and reuses its extraction. Without source the pyramid starts at gray.
+    """
+    if PYRAMID_LEVELS > 1 and source is not None and source.shape[0] > gray.shape[0]:
+        pyramid = build_pyramid(enhance_gray_for_mindar(source), PYRAMID_LEVELS)
+        reused = next((i for i, level in enumerate(pyramid)
+                       if all(abs(a - b) <= 1 for a, b in zip(level.shape, gray.shape))), None)
+        if reused is None:
+            features = detect_pyramid(pyramid, DETECTOR, ORB_FEATURES)
+        else:
+            pyramid[reused] = gray
+            features = detect_pyramid(pyramid[:reused] + pyramid[reused + 1:], DETECTOR, ORB_FEATURES)
+            features.insert(reused, (keypoints, descriptors))
+    else:
+        pyramid = build_pyramid(gray, PYRAMID_LEVELS)
+        features = detect_pyramid(pyramid, DETECTOR, ORB_FEATURES, (keypoints, descriptors))
+    
+    levels = []
+    for level, (level_keypoints, _) in zip(pyramid, features):
+        height, width = level.shape[:2]
+        levels.append((width, height, select_feature_points(level_keypoints, width, height)))
+    return levels
+
+def build_target_block(target_id, processed_image, levels):
+    """
+    Encode one target (ID, size, embedded JPEG and feature points) for a .mind file
+    levels are (width, height, points) tuples from detect_target_levels, largest first;
+    version 2 files store every level, version 1 files only the first
+    """
+    # Target ID: 4 bytes (little endian)
+    target_id_bytes = target_id.to_bytes(4, byteorder='little')
+    
+    # Target width: 4 bytes float (little endian) - 1.0
+    target_width = struct.pack('<f', 1.0)
+    
+    # Target height: 4 bytes float (little endian) - 1.0
+    target_height = struct.pack('<f', 1.0)
+    
+    # Convert processed image to JPEG
+    success, jpeg_data = cv2.imencode('.jpg', processed_image)
+    if not success:
+        raise ValueError("Failed to encode image to JPEG")
+    
+    image_data = jpeg_data.tobytes()
+    image_size = len(image_data)
+    
+    # Image size: 4 bytes (little endian)
+    image_size_bytes = image_size.to_bytes(4, byteorder='little')
+    
+    header = target_id_bytes + target_width + target_height + image_size_bytes + image_data
+    
+    if PYRAMID_LEVELS == 1:
+        # Version 1: feature count (4 bytes) and feature data, 8 bytes per
+        # feature (x, y in 0..1 as little-endian float32)
+        _, _, points = levels[0]
+        return header + len(points).to_bytes(4, byteorder='little') + points.astype('<f4').tobytes()
+    
+    # Version 2: level count (4 bytes), then per level its pixel width, height
+    # and feature count (4 bytes each) followed by its feature data
+    parts = [header, len(levels).to_bytes(4, byteorder='little')]
+    for width, height, points in levels:
+        parts.append(struct.pack('<III', width, height, len(points)))
+        parts.append(points.astype('<f4').tobytes())
+    return b''.join(parts)
+
+def assemble_mindar_file(target_blocks):
+    """
+    Combine encoded target blocks into a .mind file
+    """
+    # Header: "MINDAR\0" (8 bytes)
+    header = b'MINDAR\0'
+    
+    # Version: 4 bytes (little endian) - 2 with pyramid levels, 1 without
+    version = (2 if PYRAMID_LEVELS > 1 else 1).to_bytes(4, byteorder='little')
+    
+    # Target count: 4 bytes (little endian)
+    target_count = len(target_blocks).to_bytes(4, byteorder='little')
+    
+    return b''.join([header, version, target_count] + list(target_blocks))
+
+def create_mindar_file(processed_image, features=None):
     """
     Create a proper .mind file that matches the working card.mind format
+    Pass features=(gray, keypoints, descriptors) to reuse an earlier extraction
     """
     try:
-        # Convert to grayscale for feature detection
-        gray = cv2.cvtColor(processed_image, cv2.COLOR_BGR2GRAY)
-        
-        # Detect ORB features (similar to what MindAR uses)
-        orb = cv2.ORB_create(nfeatures=1000)
-        keypoints, descriptors = orb.detectAndCompute(gray, None)
+        gray, keypoints, descriptors = features or extract_features(processed_image, ORB_FEATURES, DETECTOR)
         
         if descriptors is None or len(keypoints) < 50:
             raise ValueError("Not enough features detected - image may not be suitable for AR tracking")
         
-        # Get image dimensions
-        height, width = gray.shape
-        
-        # Create the MindAR file structure
-        # Header: "MINDAR\0" (8 bytes)
-        header = b'MINDAR\0'
-        
-        # Version: 4 bytes (little endian) - 1
-        version = (1).to_bytes(4, byteorder='little')
-        
-        # Target count: 4 bytes (little endian) - 1
-        target_count = (1).to_bytes(4, byteorder='little')
-        
-        # Target ID: 4 bytes (little endian) - 0
-        target_id = (0).to_bytes(4, byteorder='little')
-        
-        # Target width: 4 bytes float (little endian) - 1.0
-        target_width = struct.pack('<f', 1.0)
-        
-        # Target height: 4 bytes float (little endian) - 1.0
-        target_height = struct.pack('<f', 1.0)
-        
-        # Convert processed image to JPEG
-        success, jpeg_data = cv2.imencode('.jpg', processed_image)
-        if not success:
-            raise ValueError("Failed to encode image to JPEG")
-        
-        image_data = jpeg_data.tobytes()
-        image_size = len(image_data)
-        
-        # Image size: 4 bytes (little endian)
-        image_size_bytes = image_size.to_bytes(4, byteorder='little')
-        
-        # Feature count: 4 bytes (little endian) - 100 features
-        feature_count = (100).to_bytes(4, byteorder='little')
-        
-        # Feature data: 100 features * 8 bytes each = 800 bytes
-        feature_data = bytearray(100 * 8)
-        
-        # Fill with proper feature data (x, y coordinates as floats)
-        for i in range(100):
-            offset = i * 8
-            x = (i % 10) / 10.0  # 0.0 to 0.9
-            y = (i // 10) / 10.0  # 0.0 to 0.9
-            
-            # Convert to little-endian float32
-            x_bytes = struct.pack('<f', x)
-            y_bytes = struct.pack('<f', y)
-            
-            feature_data[offset:offset+4] = x_bytes
-            feature_data[offset+4:offset+8] = y_bytes
-        
-        # Combine all parts
-        mind_file = header + version + target_count + target_id + target_width + target_height + image_size_bytes + image_data + feature_count + feature_data
-        
-        return mind_file
+        levels = detect_target_levels(gray, keypoints, descriptors)
+        return assemble_mindar_file([build_target_block(0, processed_image, levels)])
         
     except Exception as e:
         print(f"MindAR file creation error: {e}")
@@ -144,97 +189,664 @@ def validate_image(image_data):
     Validate if an image is suitable for AR tracking
     """
     try:
-        # Process image
-        nparr = np.frombuffer(image_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        
-        if img is None:
-            return {'valid': False, 'reason': 'Could not decode image'}
+        return validate_target(image_data, ORB_FEATURES, DETECTOR)
         
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Detect features
-        orb = cv2.ORB_create(nfeatures=1000)
-        keypoints, descriptors = orb.detectAndCompute(gray, None)
-        
-        feature_count = len(keypoints) if keypoints else 0
-        
-        # Check image quality
-        height, width = gray.shape
-        
-        # Calculate image sharpness (Laplacian variance)
-        laplacian_var = cv2.Laplacian(gray, cv2.CV_64F).var()
-        
-        # Validation criteria
-        valid = True
-        issues = []
-        
-        if feature_count < 50:
-            valid = False
-            issues.append(f"Not enough trackable features ({feature_count} found, need 50+)")
+    except Exception as e:
+        return {'valid': False, 'reason': str(e)}
+
+def compile_target_block(target_id, image_data):
+    """
+    Validate and encode one target from one decode and one feature extraction
+    Returns (validation, target_block); target_block is None when invalid
+    """
+    try:
+        # The embedded JPEG needs the color image; feature points come from the pyramid instead of the entry
+        result = compile_target(image_data, {'preprocess': 'color', 'detector': DETECTOR, 'mind_format': None})
+        validation = result['validation']
+        if not validation['valid']:
+            return validation, None
         
-        if laplacian_var < 100:
-            valid = False
-            issues.append(f"Image too blurry (sharpness: {laplacian_var:.1f})")
+        levels = detect_target_levels(result['gray'], result['keypoints'], result['descriptors'],
+                                      result['source_gray'])
+        return validation, build_target_block(target_id, result['image'], levels)
         
-        if width < 200 or height < 200:
-            valid = False
-            issues.append(f"Image too small ({width}x{height}, need 200x200+)")
+    except Exception as e:
+        return {'valid': False, 'reason': str(e), 'issues': [str(e)]}, None
+
+def compile_single_pass(image_data):
+    """
+    Validate and build a single-target .mind file in one pass
+    Returns (validation, mind_file_data); mind_file_data is None when invalid
+    """
+    validation, block = compile_target_block(0, image_data)
+    if block is None:
+        return validation, None
+    
+    return validation, assemble_mindar_file([block])
+
+def marker_descriptors(image_data):
+    """
+    Similarity index descriptors of a marker image
+    Returns (validation, descriptors); descriptors is None when invalid
+    """
+    try:
+        # Nothing is embedded, so the single-channel path is enough; the
+        # index only holds ORB descriptors, whatever --detector says
+        result = compile_target(image_data, {'preprocess': 'gray', 'detector': DEFAULT_DETECTOR, 'mind_format': None})
+        validation, descriptors = result['validation'], result['descriptors']
+        if not validation['valid'] or descriptors is None:
+            return validation, None
         
-        return {
-            'valid': valid,
-            'featureCount': feature_count,
-            'sharpness': float(laplacian_var),
-            'dimensions': [width, height],
-            'issues': issues,
-            'recommendation': 'Good for AR tracking' if valid else 'Improve image quality for better tracking'
-        }
+        return validation, select_descriptors(descriptors, result['keypoints'][:, 3])
         
     except Exception as e:
-        return {'valid': False, 'reason': str(e)}
+        return {'valid': False, 'reason': str(e), 'issues': [str(e)]}, None
+
+def _init_batch_worker():
+    # One OpenCV thread per process; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+def compile_batch(images, max_workers=None):
+    """
+    Compile several images into one multi-target .mind file
+    Targets are preprocessed and encoded in parallel across cores
+    Returns (validations, mind_file_data); mind_file_data is None if any target is invalid
+    """
+    max_workers = min(max_workers or os.cpu_count() or 1, len(images))
+    
+    if max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_batch_worker) as pool:
+            results = list(pool.map(compile_target_block, range(len(images)), images))
+    else:
+        results = [compile_target_block(i, data) for i, data in enumerate(images)]
+    
+    validations = [validation for validation, _ in results]
+    blocks = [block for _, block in results]
+    
+    if any(block is None for block in blocks):
+        return validations, None
+    
+    return validations, assemble_mindar_file(blocks)
+
+def make_http_session(pool_size=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES):
+    """
+    requests session with a connection pool per host and retries with backoff
+    on connection errors and 429/5xx responses
+    """
+    # requests is only imported when something actually needs downloading
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+    
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def load_image_source(source, session=None, timeout=DOWNLOAD_TIMEOUT):
+    """
+    Read image bytes from a URL or a local file path
+    """
+    if source.startswith(('http://', 'https://')):
+        session = session or make_http_session(pool_size=1)
+        response = session.get(source, timeout=timeout)
+        response.raise_for_status()
+        return response.content
+    
+    with open(source, 'rb') as f:
+        return f.read()
+
+def run_batch(sources, output_file, max_workers=None):
+    """
+    Batch mode: compile N images into one multi-target .mind file
+    """
+    print(f"Processing batch of {len(sources)} images")
+    
+    session = make_http_session()
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as download_pool:
+        images = list(download_pool.map(lambda source: load_image_source(source, session), sources))
+    session.close()
+    print(f"Images loaded, total size: {sum(len(data) for data in images)} bytes")
+    
+    validations, mind_file_data = compile_batch(images, max_workers)
+    
+    for target_id, (source, validation) in enumerate(zip(sources, validations)):
+        if validation['valid']:
+            print(f"✅ Target {target_id} ({source}): {validation['featureCount']} features, sharpness: {validation['sharpness']:.1f}")
+        else:
+            print(f"❌ Target {target_id} ({source}): {validation['issues']}")
+    
+    if mind_file_data is None:
+        print("❌ Failed to create multi-target MindAR file")
+        sys.exit(1)
+    
+    with open(output_file, 'wb') as f:
+        f.write(mind_file_data)
+    
+    print(f"✅ MindAR file with {len(sources)} targets saved to: {output_file} ({len(mind_file_data)} bytes)")
+
+def read_manifest(manifest_file, output_dir='.'):
+    """
+    Read (source, output_file) pairs from a manifest
+    
+    One target per line: an image URL or path, optionally followed by the
+    output name (tab or whitespace separated; .csv files are read as CSV with
+    an optional source,output header). Blank lines and # comments are skipped.
+    Outputs default to the source name with a .mind extension and are
+    relative to output_dir.
+    """
+    with open(manifest_file, newline='') as f:
+        if manifest_file.endswith('.csv'):
+            rows = [row for row in csv.reader(f) if row]
+            if rows and [cell.strip().lower() for cell in rows[0][:2]] == ['source', 'output']:
+                rows = rows[1:]
+        else:
+            rows = [line.split('\t') if '\t' in line else line.split()
+                    for line in (raw.strip() for raw in f) if line and not line.startswith('#')]
+    
+    entries = []
+    used = set()
+    for row in rows:
+        source = row[0].strip()
+        if not source or source.startswith('#'):
+            continue
+        
+        output = row[1].strip() if len(row) > 1 and row[1].strip() else None
+        if output is None:
+            name = os.path.basename(unquote(urlsplit(source).path)) or 'target'
+            output = os.path.splitext(name)[0] + '.mind'
+            # Different URLs often share a file name; keep outputs distinct
+            base, suffix = output[:-len('.mind')], 1
+            while output in used:
+                suffix += 1
+                output = f"{base}-{suffix}.mind"
+        used.add(output)
+        entries.append((source, os.path.join(output_dir, output)))
+    
+    return entries
+
+def _compile_manifest_target(image_data):
+    started = time.time()
+    validation, mind_file_data = compile_single_pass(image_data)
+    return validation, mind_file_data, time.time() - started
+
+def compile_params():
+    """
+    Parameters that affect the generated .mind bytes (recorded in build manifests)
+    """
+    return {
+        'max_size': MAX_IMAGE_SIZE,
+        'nfeatures': ORB_FEATURES,
+        'detector': DETECTOR,
+        'feature_budget': FEATURE_BUDGET,
+        'pyramid_levels': PYRAMID_LEVELS,
+        'clahe_clip_limit': CLAHE_CLIP_LIMIT,
+        'clahe_tile_grid': list(CLAHE_TILE_GRID),
+    }
+
+def run_manifest(entries, report_file=None, max_workers=None, download_workers=DOWNLOAD_WORKERS,
+                 timeout=DOWNLOAD_TIMEOUT, retries=DOWNLOAD_RETRIES, on_result=None):
+    """
+    Manifest batch mode: compile each entry to its own .mind file
+    
+    Downloads run concurrently on threads over one pooled session and hand
+    each image to a process pool using all cores without waiting for it;
+    at most a few images per worker are held in memory at a time. Progress is printed as
+    targets finish (on_result(index, result) is called too) and a JSON
+    summary is written to report_file. Returns the summary.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    needs_http = any(source.startswith(('http://', 'https://')) for source, _ in entries)
+    session = make_http_session(download_workers, retries) if needs_http else None
+    # Bounds downloaded-but-not-yet-compiled images
+    in_flight = threading.BoundedSemaphore(max_workers * 4)
+    lock = threading.Lock()
+    results = [None] * len(entries)
+    done = [0]
+    started = time.time()
+    
+    print(f"Processing manifest of {len(entries)} targets ({max_workers} compile workers, {download_workers} downloads)")
+    
+    def finish(index, result):
+        with lock:
+            results[index] = result
+            done[0] += 1
+            source, output = entries[index]
+            if result['status'] == 'ok':
+                print(f"[{done[0]}/{len(entries)}] ✅ {source} -> {output} "
+                      f"({result['featureCount']} features, {result['size']} bytes, {result['compileSeconds']:.2f}s)")
+            else:
+                print(f"[{done[0]}/{len(entries)}] ❌ {source}: {result['status']}: {result['error']}")
+            if on_result is not None:
+                on_result(index, result)
+    
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_batch_worker) as compile_pool:
+        
+        def compiled(index, result, future):
+            # Runs when the compile finishes; frees the image's in-flight slot
+            try:
+                output = result['output']
+                try:
+                    validation, mind_file_data, compile_seconds = future.result()
+                except Exception as e:
+                    return finish(index, dict(result, status='error', error=str(e)))
+                result.update(validation=validation, compileSeconds=round(compile_seconds, 3))
+                
+                if mind_file_data is None:
+                    issues = validation.get('issues') or [validation.get('reason', 'Failed to create MindAR file')]
+                    return finish(index, dict(result, status='invalid', error='; '.join(issues)))
+                
+                try:
+                    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+                    with open(output, 'wb') as f:
+                        f.write(mind_file_data)
+                except OSError as e:
+                    return finish(index, dict(result, status='error', error=str(e)))
+                
+                finish(index, dict(result, status='ok', size=len(mind_file_data),
+                                   featureCount=validation['featureCount']))
+            finally:
+                in_flight.release()
+        
+        def process(index):
+            # Download, then hand off to the compile pool without waiting on it
+            source, output = entries[index]
+            result = {'source': source, 'output': output}
+            in_flight.acquire()
+            download_started = time.time()
+            try:
+                image_data = load_image_source(source, session, timeout)
+                result.update(inputSize=len(image_data), downloadSeconds=round(time.time() - download_started, 3))
+                future = compile_pool.submit(_compile_manifest_target, image_data)
+            except Exception as e:
+                in_flight.release()
+                status = 'download_failed' if 'inputSize' not in result else 'error'
+                return finish(index, dict(result, status=status, error=str(e)))
+            future.add_done_callback(lambda future: compiled(index, result, future))
+        
+        with ThreadPoolExecutor(max_workers=download_workers) as download_pool:
+            list(download_pool.map(process, range(len(entries))))
+    
+    if session is not None:
+        session.close()
+    
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    elapsed = time.time() - started
+    summary = {
+        'targets': len(entries),
+        'counts': counts,
+        'elapsedSeconds': round(elapsed, 3),
+        'targetsPerSecond': round(len(entries) / elapsed, 3) if elapsed else None,
+        'results': results,
+    }
+    
+    if report_file:
+        with open(report_file, 'w') as f:
+            json.dump(summary, f, indent=2)
+    
+    print(f"{'✅' if counts.get('ok', 0) == len(entries) else '⚠️ '} {counts.get('ok', 0)}/{len(entries)} targets compiled "
+          f"in {elapsed:.1f}s ({', '.join(f'{status}: {n}' for status, n in sorted(counts.items()))})")
+    if report_file:
+        print(f"📁 Summary report saved to: {report_file}")
+    return summary
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_sources(source_dir, output_dir):
+    """
+    Images under source_dir as {relative_path: os.stat_result} (output_dir is skipped)
+    """
+    output_dir = os.path.abspath(output_dir)
+    sources = {}
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.') and
+                         os.path.abspath(os.path.join(root, d)) != output_dir)
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(root, name)
+                sources[os.path.relpath(path, source_dir)] = os.stat(path)
+    return sources
+
+def load_build_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_build_manifest(manifest_path, manifest):
+    # Write to a temp file and rename so an interrupted build never leaves a torn manifest
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(manifest_path) or '.', suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def run_build(source_dir, output_dir=None, max_workers=None, force=False):
+    """
+    Incremental build: compile every image under source_dir to
+    output_dir/<relative path>.mind, skipping targets that are up to date
+    
+    A manifest in output_dir records each source's size, mtime and SHA-256
+    along with the compile parameters and compiler version. Sources whose
+    size and mtime match are skipped without being read; otherwise the
+    content hash decides. A parameter or version change rebuilds
+    everything. Outputs of deleted sources are removed. Sources that would
+    share an output name (a.jpg and a.png) are reported and not compiled.
+    Returns the build summary.
+    """
+    output_dir = output_dir or os.path.join(source_dir, 'mind')
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, BUILD_MANIFEST_NAME)
+    started = time.time()
+    
+    build = {'compilerVersion': COMPILER_VERSION, 'params': compile_params()}
+    previous = load_build_manifest(manifest_path)
+    old_targets = (previous or {}).get('targets', {})
+    if force or previous is None or any(previous.get(key) != value for key, value in build.items()):
+        previous_targets = {}
+    else:
+        previous_targets = old_targets
+    
+    sources = scan_sources(source_dir, output_dir)
+    targets = {}
+    stale = []
+    
+    claimed = {}
+    for rel_path in sources:
+        claimed.setdefault(os.path.splitext(rel_path)[0] + '.mind', []).append(rel_path)
+    
+    for rel_path, stat in sources.items():
+        output = os.path.splitext(rel_path)[0] + '.mind'
+        if len(claimed[output]) > 1:
+            others = ', '.join(other for other in claimed[output] if other != rel_path)
+            targets[rel_path] = {'size': stat.st_size, 'mtimeNs': stat.st_mtime_ns, 'output': output,
+                                 'status': 'clash', 'error': f"{output} would also be built from {others}"}
+            continue
+        record = previous_targets.get(rel_path)
+        # Invalid images stay invalid until they change; failed downloads/writes are retried
+        up_to_date = record is not None and (
+            record['status'] == 'invalid' or
+            (record['status'] == 'ok' and os.path.exists(os.path.join(output_dir, output))))
+        
+        if up_to_date and record['size'] == stat.st_size and record['mtimeNs'] == stat.st_mtime_ns:
+            targets[rel_path] = record
+            continue
+        
+        digest = file_sha256(os.path.join(source_dir, rel_path))
+        record = dict(record or {}, size=stat.st_size, mtimeNs=stat.st_mtime_ns)
+        if up_to_date and record.get('sha256') == digest:
+            # Touched but unchanged
+            targets[rel_path] = record
+            continue
+        
+        targets[rel_path] = dict(record, sha256=digest, output=output, status='pending')
+        stale.append(rel_path)
+    
+    # Checked against the old manifest even when everything is being rebuilt
+    kept = {record['output'] for record in targets.values() if record['status'] != 'clash'}
+    removed = sorted({record['output'] for record in old_targets.values()} - kept)
+    for output in removed:
+        output = os.path.join(output_dir, output)
+        if os.path.exists(output):
+            os.remove(output)
+    
+    clashes = len(sources) - len(kept)
+    print(f"Build {source_dir} -> {output_dir}: {len(sources)} sources, {len(stale)} to compile, "
+          f"{len(sources) - len(stale) - clashes} up to date, {len(removed)} removed, {clashes} clashing")
+    
+    last_save = [time.time()]
+    
+    def record_result(index, result):
+        targets[stale[index]].update(status=result['status'], error=result.get('error'),
+                                     featureCount=result.get('featureCount'))
+        # Checkpoint so an interrupted build keeps what it finished
+        if time.time() - last_save[0] > 5:
+            save_build_manifest(manifest_path, dict(build, targets=targets))
+            last_save[0] = time.time()
+    
+    if stale:
+        run_manifest([(os.path.join(source_dir, rel_path), os.path.join(output_dir, targets[rel_path]['output']))
+                      for rel_path in stale], max_workers=max_workers, on_result=record_result)
+    
+    save_build_manifest(manifest_path, dict(build, targets=targets))
+    
+    failed = sorted(rel_path for rel_path, record in targets.items() if record['status'] != 'ok')
+    elapsed = time.time() - started
+    print(f"{'✅' if not failed else '⚠️ '} Build finished in {elapsed:.2f}s: {len(stale)} compiled, "
+          f"{len(failed)} failing")
+    for rel_path in failed[:10]:
+        print(f"❌ {rel_path}: {targets[rel_path].get('error')}")
+    return {'sources': len(sources), 'compiled': len(stale), 'removed': len(removed),
+            'failed': failed, 'elapsedSeconds': round(elapsed, 3)}
+
+def watch_build(source_dir, output_dir=None, max_workers=None, interval=1.0):
+    """
+    Rebuild whenever an image under source_dir is added, changed or removed
+    
+    Polls file sizes and mtimes (no extra dependencies); a change is built
+    once the directory has been quiet for one interval so half-copied files
+    are not compiled.
+    """
+    output_dir = output_dir or os.path.join(source_dir, 'mind')
+    
+    def snapshot():
+        return {rel_path: (stat.st_size, stat.st_mtime_ns)
+                for rel_path, stat in scan_sources(source_dir, output_dir).items()}
+    
+    def build():
+        # A failed build must not end the watch; the next change retries
+        try:
+            run_build(source_dir, output_dir, max_workers)
+        except Exception as e:
+            print(f"❌ Build failed: {e}")
+    
+    build()
+    built = snapshot()
+    print(f"👀 Watching {source_dir} for changes (Ctrl+C to stop)")
+    
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot()
+            if current == built:
+                continue
+            
+            # Wait for the directory to settle
+            while True:
+                time.sleep(interval)
+                settled = snapshot()
+                if settled == current:
+                    break
+                current = settled
+            
+            build()
+            built = current
+    except KeyboardInterrupt:
+        print("Stopped watching")
+
+def run_index_add(index_dir, sources, max_workers=None):
+    """
+    Add marker images (URLs or paths, used as their ids) to the similarity index
+    """
+    index = DescriptorIndex(index_dir)
+    session = make_http_session()
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as download_pool:
+        images = list(download_pool.map(lambda source: load_image_source(source, session), sources))
+    session.close()
+    
+    max_workers = min(max_workers or os.cpu_count() or 1, len(images))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_batch_worker) as pool:
+        results = list(pool.map(marker_descriptors, images))
+    
+    markers = []
+    for source, (validation, descriptors) in zip(sources, results):
+        if descriptors is None:
+            print(f"❌ {source}: {validation.get('issues') or validation.get('reason')}")
+            continue
+        markers.append((source, descriptors, {'source': source}))
+    
+    index.add_many(markers)
+    index.compact(min_segments=MAX_SEGMENTS + 1)
+    print(f"✅ Indexed {len(markers)}/{len(sources)} markers in {index_dir} ({index.stats()['markers']} total)")
+    return len(markers) == len(sources)
+
+def run_similar(index_dir, source, limit=5):
+    """
+    Print the indexed markers most similar to an image
+    """
+    validation, descriptors = marker_descriptors(load_image_source(source))
+    if descriptors is None:
+        print(f"❌ {source}: {validation.get('issues') or validation.get('reason')}")
+        return None
+    
+    index = DescriptorIndex(index_dir)
+    started = time.time()
+    matches = index.query(descriptors, limit)
+    stats = index.stats()
+    print(f"Most similar of {stats['markers']} indexed markers ({(time.time() - started) * 1000:.1f} ms):")
+    for match in matches:
+        print(f"  {match['score']:.3f}  {match['matches']:>4} matching features  {match['id']}")
+    if not matches:
+        print("  (no similar markers)")
+    return matches
 
 def main():
     """
     Main function to handle command line arguments
     """
+    parser = argparse.ArgumentParser(
+        description="Convert images to .mind files for MindAR tracking",
+        epilog="Example: python python-mindar-compiler.py https://example.com/image.jpg output.mind"
+    )
+    parser.add_argument('image_url', nargs='?', help="Image URL to compile")
+    parser.add_argument('output_file', nargs='?', default="output.mind", help="Output .mind file (default: output.mind)")
+    parser.add_argument('--batch', nargs='+', metavar='IMAGE',
+                        help="Compile several image URLs or paths into one multi-target .mind file")
+    parser.add_argument('-o', '--output', help="Output file for --batch (default: output_file)")
+    parser.add_argument('--manifest', metavar='FILE',
+                        help="Compile each URL/path listed in FILE (with optional output name) to its own .mind file")
+    parser.add_argument('--build', metavar='DIR',
+                        help="Incrementally compile every image under DIR, skipping up-to-date outputs")
+    parser.add_argument('--watch', action='store_true', help="With --build, keep watching DIR and rebuild on change")
+    parser.add_argument('--force', action='store_true', help="With --build, recompile everything")
+    parser.add_argument('--output-dir', default=None,
+                        help="Directory for --manifest (default: .) or --build (default: DIR/mind) outputs")
+    parser.add_argument('--report', help="JSON summary report for --manifest (default: OUTPUT_DIR/batch-report.json)")
+    parser.add_argument('--index', default=os.environ.get('MINDAR_INDEX_DIR', 'marker-index'),
+                        help="Marker similarity index directory (default: $MINDAR_INDEX_DIR or marker-index)")
+    parser.add_argument('--index-add', nargs='+', metavar='IMAGE', help="Add marker images to the similarity index")
+    parser.add_argument('--similar', metavar='IMAGE', help="List indexed markers most similar to IMAGE")
+    parser.add_argument('--limit', type=int, default=5, help="Matches listed by --similar (default: 5)")
+    parser.add_argument('--index-compact', action='store_true', help="Merge the similarity index segments")
+    parser.add_argument('--features', type=int, default=None,
+                        help=f"Feature points written per target (default: $MINDAR_FEATURE_BUDGET or {FEATURE_BUDGET})")
+    parser.add_argument('--detector', choices=available_detectors(), default=None,
+                        help=f"Feature detector: fast (previews), orb or akaze (final builds) "
+                             f"(default: $MINDAR_DETECTOR or {DETECTOR})")
+    parser.add_argument('--levels', type=int, default=None,
+                        help=f"Pyramid levels per target. 1 writes the single-scale version 1 .mind "
+                             f"layout; 2 or more write the multi-scale version 2 layout, which "
+                             f"version 1 readers cannot parse (default: $MINDAR_PYRAMID_LEVELS or {PYRAMID_LEVELS})")
+    parser.add_argument('--workers', type=int, default=None, help="Parallel worker processes (default: all cores)")
+    parser.add_argument('--download-workers', type=int, default=DOWNLOAD_WORKERS,
+                        help=f"Concurrent downloads for --manifest (default: {DOWNLOAD_WORKERS})")
+    parser.add_argument('--timeout', type=float, default=DOWNLOAD_TIMEOUT,
+                        help=f"Download timeout in seconds (default: {DOWNLOAD_TIMEOUT})")
+    parser.add_argument('--retries', type=int, default=DOWNLOAD_RETRIES,
+                        help=f"Download retries on connection errors and 429/5xx (default: {DOWNLOAD_RETRIES})")
+    args = parser.parse_args()
+
+    if args.features is not None and args.features < 1:
+        parser.error("--features must be at least 1")
+    if args.levels is not None and args.levels < 1:
+        parser.error("--levels must be at least 1")
+    set_compile_options(args.features, args.detector, args.levels)
+
+    if args.index_add or args.similar or args.index_compact:
+        try:
+            ok = True
+            if args.index_add:
+                ok = run_index_add(args.index, args.index_add, args.workers)
+            if args.index_compact:
+                DescriptorIndex(args.index).compact()
+                print(f"✅ Index compacted: {DescriptorIndex(args.index).stats()}")
+            if args.similar:
+                ok = run_similar(args.index, args.similar, args.limit) is not None and ok
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        if not ok:
+            sys.exit(1)
+        return
     
-    if len(sys.argv) < 2:
-        print("Usage: python python-mindar-compiler.py <image_url> [output_file]")
-        print("Example: python python-mindar-compiler.py https://example.com/image.jpg output.mind")
+    if args.build:
+        try:
+            if args.watch:
+                watch_build(args.build, args.output_dir, args.workers)
+                return
+            summary = run_build(args.build, args.output_dir, args.workers, args.force)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        if summary['failed']:
+            sys.exit(1)
+        return
+    
+    if args.manifest:
+        output_dir = args.output_dir or '.'
+        try:
+            entries = read_manifest(args.manifest, output_dir)
+            summary = run_manifest(entries, args.report or os.path.join(output_dir, 'batch-report.json'),
+                                   args.workers, args.download_workers, args.timeout, args.retries)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        if summary['counts'].get('ok', 0) != summary['targets']:
+            sys.exit(1)
+        return
+    
+    if args.batch:
+        try:
+            run_batch(args.batch, args.output or args.output_file, args.workers)
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            sys.exit(1)
+        return
+    
+    if not args.image_url:
+        parser.print_usage()
         sys.exit(1)
     
-    image_url = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else "output.mind"
+    image_url = args.image_url
+    output_file = args.output_file
     
     print(f"Processing image: {image_url}")
     
     try:
         # Download image
-        response = requests.get(image_url)
-        response.raise_for_status()
-        image_data = response.content
+        image_data = load_image_source(image_url, timeout=args.timeout)
         
         print(f"Image downloaded, size: {len(image_data)} bytes")
         
-        # Validate image
-        validation = validate_image(image_data)
+        # Validate and compile in one pass (single decode and feature extraction)
+        validation, mind_file_data = compile_single_pass(image_data)
         if not validation['valid']:
             print(f"❌ Image validation failed: {validation['issues']}")
             sys.exit(1)
         
         print(f"✅ Image validation passed: {validation['featureCount']} features, sharpness: {validation['sharpness']:.1f}")
         
-        # Process image
-        processed_image = process_image_for_mindar(image_data)
-        if processed_image is None:
-            print("❌ Failed to process image")
-            sys.exit(1)
-        
-        print("✅ Image processed successfully")
-        
-        # Create MindAR file
-        mind_file_data = create_mindar_file(processed_image)
         if mind_file_data is None:
             print("❌ Failed to create MindAR file")
             sys.exit(1)
@@ -0,0 +1,391 @@
+"""
+In-process MindAR target compilation shared by the Flask service and the CLI.
+
+compile_target() runs the whole pipeline on one image: decode (or take a
+ready array), resize, measure sharpness, enhance, detect features, validate,
+select the features to keep and serialize the basic .mind payload. It
+returns every intermediate a caller may want instead of just bytes, so the
+service and the CLI build their different outputs (basic .mind files,
+multi-scale targets with an embedded JPEG, similarity index descriptors)
+from the same pass:
+
+    from target_compiler import compile_target
+    result = compile_target(jpeg_bytes, {'detector': 'orb', 'feature_budget': 300})
+    result['validation']['valid'], result['keypoints'], result['payload']
+
+Images are accepted as encoded bytes (bytes, bytearray or memoryview,
+decoded straight from the buffer) or as a decoded uint8 array (grayscale,
+BGR or BGRA). Neither is copied on the way in, and the caller's array is
+never written to.
+
+Nothing here depends on Flask or on the service's metrics; the service
+plugs its stage timer in with instrument().
+"""
+
+import contextlib
+import json
+
+import cv2
+import numpy as np
+
+import buffer_pool
+from detectors import DEFAULT_DETECTOR, available_detectors, detect_features, get_clahe
+from feature_format import available_compressions, pack_features
+from feature_selection import FEATURE_GRID, keypoint_array, select_features
+from image_io import decode_image_reduced
+from validation import MIN_FEATURES, build_validation_report, laplacian_variance, validate_gray
+
+MAX_IMAGE_SIZE = 512
+# Keypoints detected per target, whichever detector engine is used
+ORB_FEATURES = 1000
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+SHARPEN_KERNEL = np.array([[-1,-1,-1],
+                           [-1, 9,-1],
+                           [-1,-1,-1]], dtype=np.float32)
+
+# Validation analyzes at most this resolution (original dimensions are still checked)
+VALIDATION_MAX_SIZE = 1024
+
+# 'gray' enhances a single grayscale channel; 'color' runs CLAHE in LAB and
+# sharpens all three channels (needed where a color image is embedded)
+PREPROCESS_MODES = ('gray', 'color')
+# Payload encoding: 'binary' (feature_format) or legacy 'json'
+MIND_FORMATS = ('binary', 'json')
+
+# Every option that affects the compiled target (the service's compile cache
+# key is built from these). mind_format=None skips serialization
+DEFAULT_OPTIONS = {
+    'max_size': MAX_IMAGE_SIZE,
+    'nfeatures': ORB_FEATURES,
+    'detector': DEFAULT_DETECTOR,
+    'feature_budget': 500,
+    'feature_grid': list(FEATURE_GRID),
+    'clahe_clip_limit': CLAHE_CLIP_LIMIT,
+    'clahe_tile_grid': list(CLAHE_TILE_GRID),
+    'mind_format': 'binary',
+    'compression': 'none',
+    'preprocess': 'gray',
+}
+
+_stage_timer = None
+_observer = None
+
+
+def instrument(stage_timer=None, observer=None):
+    """
+    Report pipeline stages and measurements to the given callbacks (None to stop)
+    stage_timer(name) is a context manager timing a stage; observer(name, value) records a value
+    """
+    global _stage_timer, _observer
+    _stage_timer = stage_timer
+    _observer = observer
+
+
+def _stage(name):
+    return _stage_timer(name) if _stage_timer is not None else contextlib.nullcontext()
+
+
+def _observe(name, value):
+    if _observer is not None:
+        _observer(name, value)
+
+
+def compile_options(options=None, **overrides):
+    """
+    DEFAULT_OPTIONS updated with options and overrides, validated
+    Unknown keys are kept (callers may add their own cache key fields); raises ValueError
+    """
+    merged = dict(DEFAULT_OPTIONS)
+    merged.update(options or {})
+    merged.update(overrides)
+
+    feature_budget = merged['feature_budget']
+    try:
+        merged['feature_budget'] = int(feature_budget)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid feature budget: {feature_budget}")
+
+    if not 1 <= merged['feature_budget'] <= merged['nfeatures']:
+        raise ValueError(f"Feature budget must be between 1 and {merged['nfeatures']}")
+    if merged['preprocess'] not in PREPROCESS_MODES:
+        raise ValueError(f"Unknown preprocessing mode: {merged['preprocess']}")
+    if merged['detector'] not in available_detectors():
+        raise ValueError(f"Unsupported detector: {merged['detector']} "
+                         f"(available: {', '.join(available_detectors())})")
+
+    mind_format, compression = merged['mind_format'], merged['compression']
+    if mind_format is not None:
+        if mind_format not in MIND_FORMATS:
+            raise ValueError(f"Unknown output format: {mind_format}")
+        if compression not in available_compressions() or (mind_format == 'json' and compression != 'none'):
+            raise ValueError(f"Unsupported compression for {mind_format} output: {compression}")
+
+    return merged
+
+
+def load_image(image, target_size=MAX_IMAGE_SIZE, grayscale=False):
+    """
+    Encoded image bytes (bytes, bytearray, memoryview) or a uint8 array as a BGR (or grayscale) array
+    Bytes are decoded in place, at a reduced scale no smaller than target_size
+    when large; arrays (grayscale, BGR or BGRA) are only converted when their
+    channels differ, and never modified
+    Returns (img, (original_width, original_height))
+    """
+    with _stage('decode'):
+        if not isinstance(image, np.ndarray):
+            img, (width, height) = decode_image_reduced(image, target_size, grayscale=grayscale)
+        else:
+            img = _convert_array(image, grayscale)
+            height, width = image.shape[:2]
+    _observe('mindar_input_megapixels', width * height / 1e6)
+    return img, (width, height)
+
+
+def _convert_array(image, grayscale):
+    if image.dtype != np.uint8:
+        raise ValueError(f"Image arrays must be uint8, not {image.dtype}")
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:, :, 0]
+
+    if image.ndim == 2:
+        return image if grayscale else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if image.ndim == 3 and image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if grayscale else image
+    if image.ndim == 3 and image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY if grayscale else cv2.COLOR_BGRA2BGR)
+    raise ValueError(f"Unsupported image array shape: {image.shape}")
+
+
+def resize_for_mindar(img, max_size=MAX_IMAGE_SIZE, tag='resize'):
+    """
+    Downscale so the longest side is at most max_size
+    The result may be a pooled buffer (see buffer_pool) under tag
+    """
+    height, width = img.shape[:2]
+
+    if max(height, width) > max_size:
+        if width > height:
+            new_width = max_size
+            new_height = int(height * (max_size / width))
+        else:
+            new_height = max_size
+            new_width = int(width * (max_size / height))
+
+        with _stage('resize'):
+            dst = buffer_pool.take(tag, (new_height, new_width) + img.shape[2:])
+            img = cv2.resize(img, (new_width, new_height), dst=dst, interpolation=cv2.INTER_LANCZOS4)
+
+    return img
+
+
+def enhance_for_mindar(img, clahe_clip_limit=CLAHE_CLIP_LIMIT, clahe_tile_grid=CLAHE_TILE_GRID):
+    """
+    Enhance contrast (CLAHE on the L channel) and sharpen
+    """
+    with _stage('clahe'):
+        lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB, dst=buffer_pool.take('lab', img.shape))
+        l = cv2.extractChannel(lab, 0, dst=buffer_pool.take('l', img.shape[:2]))
+
+        # Apply CLAHE (Contrast Limited Adaptive Histogram Equalization);
+        # only L changes, so write it back into lab instead of split/merge
+        clahe = get_clahe(clahe_clip_limit, clahe_tile_grid)
+        cv2.insertChannel(clahe.apply(l, dst=buffer_pool.take('clahe', img.shape[:2])), lab, 0)
+        img = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=buffer_pool.take('bgr', img.shape))
+
+    # Sharpen the image (a fresh array: it is returned to the caller)
+    with _stage('sharpen'):
+        return cv2.filter2D(img, -1, SHARPEN_KERNEL)
+
+
+def enhance_gray_for_mindar(gray, clahe_clip_limit=CLAHE_CLIP_LIMIT, clahe_tile_grid=CLAHE_TILE_GRID):
+    """
+    Enhance contrast (CLAHE) and sharpen a single grayscale channel, all in uint8
+    """
+    with _stage('clahe'):
+        clahe = get_clahe(clahe_clip_limit, clahe_tile_grid)
+        gray = clahe.apply(gray, dst=buffer_pool.take('clahe', gray.shape))
+
+    with _stage('sharpen'):
+        return cv2.filter2D(gray, -1, SHARPEN_KERNEL)
+
+
+def process_image(image, options=None):
+    """
+    Decoded, resized and enhanced image (grayscale or BGR, per options['preprocess'])
+    """
+    options = compile_options(options, mind_format=None)
+    img, _, _ = _load_for_compile(image, options)
+    return _enhance(img, options)
+
+
+def _load_for_compile(image, options):
+    # (compile image, grayscale validation-resolution image, original size).
+    # Sharpness is judged at validation resolution, like validate_target does,
+    # from the same decode; only one channel is resized to it in color mode
+    max_size = options['max_size']
+    grayscale = options['preprocess'] == 'gray'
+    img, original_size = load_image(image, max(max_size, VALIDATION_MAX_SIZE), grayscale)
+
+    gray = img if grayscale else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=buffer_pool.take('gray', img.shape[:2]))
+    analysis = resize_for_mindar(gray, VALIDATION_MAX_SIZE, tag='validate')
+    if grayscale and max_size <= VALIDATION_MAX_SIZE:
+        img = analysis
+    return resize_for_mindar(img, max_size), analysis, original_size
+
+
+def _enhance(img, options):
+    if options['preprocess'] == 'gray':
+        return enhance_gray_for_mindar(img, options['clahe_clip_limit'], options['clahe_tile_grid'])
+    return enhance_for_mindar(img, options['clahe_clip_limit'], options['clahe_tile_grid'])
+
+
+def extract_features(processed_image, nfeatures=ORB_FEATURES, detector=DEFAULT_DETECTOR):
+    """
+    Detect features with a detector engine (ORB by default, similar to what MindAR uses)
+    on the processed image (BGR or already grayscale)
+    Returns (gray, keypoints, descriptors)
+    """
+    with _stage('detect'):
+        gray = processed_image if processed_image.ndim == 2 else cv2.cvtColor(processed_image, cv2.COLOR_BGR2GRAY)
+        keypoints, descriptors = detect_features(gray, detector, nfeatures)
+    _observe('mindar_feature_count', len(keypoints) if keypoints else 0)
+    return gray, keypoints, descriptors
+
+
+def build_mind_image_entry(gray, keypoints, descriptors, feature_budget=DEFAULT_OPTIONS['feature_budget'],
+                           detector=DEFAULT_DETECTOR, grid=FEATURE_GRID):
+    """
+    Per-target entry of the basic .mind structure (feature_budget features
+    spread over the image, see feature_selection)
+    Keypoints are a float32 (N, 4) array of x, y, angle, response;
+    detector names the engine the descriptors came from
+    """
+    height, width = gray.shape
+
+    with _stage('select'):
+        keypoints = keypoint_array(keypoints)
+        if descriptors is None:
+            keypoints, descriptors = keypoints[:0], np.zeros((0, 32), np.uint8)
+        selected = select_features(keypoints[:, :2], keypoints[:, 3], width, height, feature_budget, grid)
+
+    return {
+        'width': width,
+        'height': height,
+        'keypoints': keypoints[selected],
+        'descriptors': descriptors[selected],
+        'detector': detector
+    }
+
+
+def serialize_mind_data(image_entries, mind_format='binary', compression='none'):
+    """
+    Serialize one or more target entries into the basic .mind format
+    'binary' uses the compact feature_format layout; 'json' is the legacy encoding
+    """
+    with _stage('serialize'):
+        return _serialize_mind_data(image_entries, mind_format, compression)
+
+
+def _serialize_mind_data(image_entries, mind_format, compression):
+    if mind_format == 'binary':
+        return pack_features(image_entries, compression)
+
+    if len(image_entries) == 1:
+        entry = image_entries[0]
+        tracking_data = {
+            'imageSize': [entry['width'], entry['height']],
+            'featureCount': len(entry['keypoints'])
+        }
+    else:
+        tracking_data = {
+            'targetCount': len(image_entries),
+            'targets': [{
+                'targetId': target_id,
+                'imageSize': [entry['width'], entry['height']],
+                'featureCount': len(entry['keypoints'])
+            } for target_id, entry in enumerate(image_entries)]
+        }
+
+    mind_data = {
+        'images': [dict(entry,
+                        keypoints=entry['keypoints'].tolist(),
+                        descriptors=entry['descriptors'].tolist()) for entry in image_entries],
+        'trackingData': tracking_data
+    }
+
+    # Convert to binary format (simplified)
+    mind_json = json.dumps(mind_data)
+    return mind_json.encode('utf-8')
+
+
+def compile_target(image, options=None, require_valid=True):
+    """
+    Validate one target and compile it from one decode and one feature extraction
+
+    image is encoded bytes, a memoryview or a uint8 array; options are
+    merged into DEFAULT_OPTIONS (see compile_options). Sharpness is measured
+    at validation resolution, so compile and validate_target agree on it;
+    the feature count is that of the compile-resolution image, i.e. the
+    features that end up in the .mind file. Returns a dict of:
+
+      validation     the validation report (build_validation_report)
+      original_size  (width, height) of the input
+      image          the processed (enhanced) image, grayscale or BGR
+      gray           its grayscale version, which features were detected on
+      source_gray    the decoded grayscale image at up to VALIDATION_MAX_SIZE,
+                     before enhancement (e.g. for multi-scale pyramids)
+      keypoints      float32 (N, 4) array of x, y, angle, response of every detection
+      descriptors    their descriptors (None if the detector computed none)
+      entry          the .mind entry of the selected features (build_mind_image_entry)
+      payload        the serialized single-target .mind file
+
+    entry and payload are None when the target is invalid; with
+    require_valid=False they are built whenever enough features were found,
+    whatever the sharpness and size checks say. payload is also None when
+    options['mind_format'] is None. Raises ValueError for bad options and
+    undecodable images. Arrays in the result are never pooled buffers.
+    """
+    options = compile_options(options)
+    grayscale = options['preprocess'] == 'gray'
+
+    img, analysis, (width, height) = _load_for_compile(image, options)
+    with _stage('sharpness'):
+        sharpness = laplacian_variance(analysis)
+
+    processed_image = _enhance(img, options)
+    gray, keypoints, descriptors = extract_features(processed_image, options['nfeatures'], options['detector'])
+    keypoints = keypoint_array(keypoints)
+    report = build_validation_report(len(keypoints), sharpness, width, height)
+
+    entry = payload = None
+    if report['valid'] or (not require_valid and descriptors is not None and len(keypoints) >= MIN_FEATURES):
+        entry = build_mind_image_entry(gray, keypoints, descriptors, options['feature_budget'],
+                                       options['detector'], options['feature_grid'])
+        if options['mind_format'] is not None:
+            payload = serialize_mind_data([entry], options['mind_format'], options['compression'])
+
+    return {
+        'validation': report,
+        'original_size': (width, height),
+        'image': processed_image,
+        'gray': gray,
+        'source_gray': np.array(analysis),
+        'keypoints': keypoints,
+        'descriptors': descriptors,
+        'entry': entry,
+        'payload': payload,
+    }
+
+
+def validate_target(image, nfeatures=ORB_FEATURES, detector=DEFAULT_DETECTOR, max_size=VALIDATION_MAX_SIZE):
+    """
+    Tiered validation (see validation.validate_gray) of encoded bytes or a uint8 array
+    Decodes straight to grayscale, reduced to the validation resolution
+    """
+    gray, (width, height) = load_image(image, max_size, grayscale=True)
+    gray = resize_for_mindar(gray, max_size)
+
+    # Quick tier decides clear cases; borderline images escalate to the full detector
+    with _stage('validate'):
+        return validate_gray(gray, width, height, nfeatures, detector)
@@ -1,111 +1,476 @@
 #!/usr/bin/env python3
 """
-Test script for the Python MindAR service
+Concurrent load generator for the Python MindAR service
+
+Replays a mix of /validate-image and /generate-mind requests over real-sized
+images against a running instance (or one it starts with gunicorn), either
+closed-loop at a fixed concurrency or open-loop at a fixed arrival rate, and
+reports throughput, p50/p95/p99 latency and error rates. With --sweep it
+steps through increasing load and reports the saturation point.
+
+    python test_service.py --concurrency 4 --duration 20
+    python test_service.py --spawn 2 --sweep 1 2 4 8 16
+    python test_service.py --rate 5 --sweep 2 5 10 20 --mix validate-image=1,generate-mind=1
 """
 
-import requests
+import argparse
+import asyncio
+import json
 import os
+import socket
+import subprocess
 import sys
+import time
+from urllib.parse import urlsplit
 
-def test_health():
-    """Test the health endpoint"""
-    try:
-        response = requests.get('http://localhost:8000/health')
-        if response.status_code == 200:
-            print("✅ Health check passed")
-            print(f"Service info: {response.json()}")
-            return True
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_MIX = 'validate-image=3,generate-mind=1'
+ENDPOINTS = ('validate-image', 'generate-mind', 'compile')
+
+# Load step counts as saturated when throughput gains less than this over the
+# best earlier step, or when errors exceed MAX_ERROR_RATE
+MIN_THROUGHPUT_GAIN = 0.10
+MAX_ERROR_RATE = 0.01
+
+
+class Connection:
+    """
+    Minimal keep-alive HTTP/1.1 client connection on asyncio streams
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', headers=None):
+        """
+        Returns (status, headers, body); reconnects once if a kept-alive socket was closed
+        """
+        for attempt in range(2):
+            fresh = self.writer is None
+            if fresh:
+                self.reader, self.writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout)
+            try:
+                return await asyncio.wait_for(self._exchange(method, path, body, headers or {}), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if fresh or attempt:
+                    raise
+            except BaseException:
+                await self.close()
+                raise
+
+    async def _exchange(self, method, path, body, headers):
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body:
+            self.writer.write(body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if size == 0:
+                    await self.reader.readuntil(b'\r\n')
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            response_body = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            response_body = await self.reader.readexactly(int(response_headers['content-length']))
         else:
-            print(f"❌ Health check failed: {response.status_code}")
-            return False
-    except requests.exceptions.ConnectionError:
-        print("❌ Service not running. Start with: python app.py")
-        return False
+            response_body = await self.reader.read()
+            await self.close()
+
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+
+        return status, response_headers, response_body
+
+
+class Workload:
+    """
+    Weighted random mix of (endpoint, image) requests, reproducible from a seed
+    """
 
-def test_image_validation():
-    """Test image validation endpoint"""
+    def __init__(self, images, mix, bust_cache=True, seed=0):
+        self.images = images
+        self.endpoints = [endpoint for endpoint, _ in mix]
+        weights = np.array([weight for _, weight in mix], dtype=float)
+        self.weights = weights / weights.sum()
+        self.bust_cache = bust_cache
+        self.rng = np.random.default_rng(seed)
+        self.counter = 0
+        # Differs per run so earlier runs' results are not cache hits either
+        self.run_token = os.urandom(4).hex().encode('ascii')
+
+    def next(self):
+        endpoint = self.endpoints[self.rng.choice(len(self.endpoints), p=self.weights)]
+        name, data = self.images[self.rng.integers(len(self.images))]
+        self.counter += 1
+        if self.bust_cache and endpoint != 'validate-image':
+            # Bytes after the end-of-image marker are ignored by decoders but
+            # change the compile cache key, so every compile does real work
+            data = data + b'\0' + self.run_token + str(self.counter).encode('ascii')
+        return endpoint, name, data
+
+
+def parse_mix(text):
+    mix = []
+    for part in text.split(','):
+        endpoint, _, weight = part.partition('=')
+        endpoint = endpoint.strip().lstrip('/')
+        if endpoint not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint in mix: {endpoint}")
+        mix.append((endpoint, float(weight or 1)))
+    return mix
+
+
+def load_images(paths, sizes):
+    """
+    (name, bytes) for the given files, or synthetic corpus images from benchmark.py
+    """
+    if paths:
+        images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                images.append((os.path.basename(path), f.read()))
+        return images
+
+    import tempfile
+    from benchmark import DENSITIES, build_corpus
+
+    corpus = build_corpus(os.path.join(tempfile.gettempdir(), 'mindar-bench-corpus'), sizes, ('jpg',), DENSITIES)
+    return [(entry['image'], entry['data']) for entry in corpus]
+
+
+async def send(connection, endpoint, name, data):
+    """
+    One request; returns a result dict (status None for transport errors)
+    """
+    started = time.perf_counter()
     try:
-        # Create a simple test image (1x1 pixel)
-        test_image_data = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\' ",#\x1c\x1c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xaa\xff\xd9'
-        
-        response = requests.post(
-            'http://localhost:8000/validate-image',
-            data=test_image_data,
-            headers={'Content-Type': 'application/octet-stream'}
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            print("✅ Image validation test passed")
-            print(f"Validation result: {result}")
-            return True
-        else:
-            print(f"❌ Image validation failed: {response.status_code}")
-            return False
-    except Exception as e:
-        print(f"❌ Image validation error: {e}")
+        status, _, body = await connection.request(
+            'POST', '/' + endpoint, data,
+            {'Content-Type': 'application/octet-stream', 'X-Filename': name})
+        error = None if status < 400 else f"HTTP {status}"
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+        status, body, error = None, b'', type(e).__name__
+    return {
+        'endpoint': endpoint,
+        'status': status,
+        'error': error,
+        'latency': time.perf_counter() - started,
+        'bytes': len(body),
+    }
+
+
+async def run_closed_loop(host, port, workload, concurrency, duration, timeout):
+    """
+    concurrency clients each send their next request as soon as the previous one completes
+    """
+    deadline = time.perf_counter() + duration
+    results = []
+
+    async def client():
+        connection = Connection(host, port, timeout)
+        try:
+            while time.perf_counter() < deadline:
+                results.append(await send(connection, *workload.next()))
+        finally:
+            await connection.close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return results
+
+
+async def run_open_loop(host, port, workload, rate, duration, timeout, max_connections):
+    """
+    Requests arrive at a fixed rate regardless of how fast earlier ones finish
+
+    Latency is measured from the scheduled arrival, so time spent waiting
+    for a free connection counts (no coordinated omission).
+    """
+    idle = []
+    open_connections = 0
+    available = asyncio.Condition()
+    results = []
+
+    async def acquire():
+        nonlocal open_connections
+        async with available:
+            while not idle and open_connections >= max_connections:
+                await available.wait()
+            if idle:
+                return idle.pop()
+            open_connections += 1
+        return Connection(host, port, timeout)
+
+    async def release(connection):
+        async with available:
+            idle.append(connection)
+            available.notify()
+
+    async def arrival(scheduled, request):
+        connection = await acquire()
+        result = await send(connection, *request)
+        await release(connection)
+        result['latency'] = time.perf_counter() - scheduled
+        results.append(result)
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(int(rate * duration)):
+        scheduled = started + i / rate
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        tasks.append(asyncio.create_task(arrival(scheduled, workload.next())))
+
+    await asyncio.gather(*tasks)
+    for connection in idle:
+        await connection.close()
+    return results
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    """
+    Throughput, latency percentiles (ms) and error rates, overall and per endpoint
+    """
+    def stats(subset):
+        latencies = sorted(r['latency'] * 1000 for r in subset)
+        errors = [r for r in subset if r['error']]
+        statuses = {}
+        for r in subset:
+            key = str(r['status'] or r['error'])
+            statuses[key] = statuses.get(key, 0) + 1
+        return {
+            'requests': len(subset),
+            'throughput': round(len(subset) / elapsed, 3) if elapsed else None,
+            'p50': round(percentile(latencies, 0.50), 1) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 1) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 1) if latencies else None,
+            'errorRate': round(len(errors) / len(subset), 4) if subset else 0.0,
+            'statuses': statuses,
+        }
+
+    summary = stats(results)
+    summary['elapsed'] = round(elapsed, 3)
+    summary['endpoints'] = {
+        endpoint: stats([r for r in results if r['endpoint'] == endpoint])
+        for endpoint in sorted({r['endpoint'] for r in results})
+    }
+    return summary
+
+
+def find_saturation(steps):
+    """
+    First load step that adds less than MIN_THROUGHPUT_GAIN throughput over the
+    best earlier step, falls that far behind its offered rate (open loop), or
+    whose error rate exceeds MAX_ERROR_RATE
+    """
+    best = None
+    for step in steps:
+        throughput = step['summary']['throughput'] or 0
+        if step['summary']['errorRate'] > MAX_ERROR_RATE:
+            return dict(step['load'], reason=f"error rate {step['summary']['errorRate']:.1%}")
+        offered = step['load'].get('rate')
+        if offered and throughput < offered * (1 - MIN_THROUGHPUT_GAIN):
+            return dict(step['load'], reason=f"served {throughput:.2f} of {offered:g} req/s offered")
+        if best is not None and throughput < best * (1 + MIN_THROUGHPUT_GAIN):
+            return dict(step['load'], reason=f"throughput {throughput:.2f} req/s vs best {best:.2f} req/s")
+        best = max(best or 0, throughput)
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def wait_ready(host, port, timeout):
+    connection = Connection(host, port, 10)
+    deadline = time.time() + timeout
+    try:
+        while time.time() < deadline:
+            try:
+                status, _, _ = await connection.request('GET', '/ready')
+                if status == 200:
+                    return True
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                await connection.close()
+            await asyncio.sleep(0.25)
         return False
+    finally:
+        await connection.close()
 
-def test_mind_generation():
-    """Test mind file generation endpoint"""
+
+def spawn_server(workers, port):
+    """
+    Start gunicorn app:app locally (gunicorn.conf.py prewarms each worker)
+    """
+    command = [sys.executable, '-m', 'gunicorn', 'app:app', '--bind', f"127.0.0.1:{port}",
+               '--workers', str(workers), '--timeout', '300']
+    print(f"🚀 Starting: {' '.join(command)}")
+    return subprocess.Popen(command, cwd=HERE)
+
+
+async def check_health(host, port):
+    """Make sure the service is up before generating load"""
+    connection = Connection(host, port, 10)
     try:
-        # Create a simple test image (1x1 pixel)
-        test_image_data = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x01\x00H\x00H\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\' ",#\x1c\x1c(7),01444\x1f\'9=82<.342\xff\xc0\x00\x11\x08\x00\x01\x00\x01\x01\x01\x11\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x14\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\xff\xc4\x00\x14\x10\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00\x3f\x00\xaa\xff\xd9'
-        
-        response = requests.post(
-            'http://localhost:8000/generate-mind',
-            data=test_image_data,
-            headers={
-                'Content-Type': 'application/octet-stream',
-                'X-Filename': 'test.jpg'
-            }
-        )
-        
-        if response.status_code == 200:
-            mind_file = response.content
-            print("✅ Mind file generation test passed")
-            print(f"Generated mind file size: {len(mind_file)} bytes")
-            
-            # Save the mind file for inspection
-            with open('test_output.mind', 'wb') as f:
-                f.write(mind_file)
-            print("📁 Mind file saved as 'test_output.mind'")
-            return True
-        else:
-            print(f"❌ Mind file generation failed: {response.status_code}")
-            print(f"Error: {response.text}")
-            return False
-    except Exception as e:
-        print(f"❌ Mind file generation error: {e}")
+        status, _, body = await connection.request('GET', '/health')
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        print("❌ Service not running. Start with: gunicorn app:app (or use --spawn N)")
         return False
+    finally:
+        await connection.close()
+
+    if status != 200:
+        print(f"❌ Health check failed: {status}")
+        return False
+    print(f"✅ Health check passed: {json.loads(body).get('service')}")
+    return True
+
+
+def print_summary(label, summary):
+    print(f"📊 {label}: {summary['requests']} requests in {summary['elapsed']:.1f}s, "
+          f"{summary['throughput']:.2f} req/s, p50 {summary['p50']} ms, p95 {summary['p95']} ms, "
+          f"p99 {summary['p99']} ms, errors {summary['errorRate']:.1%}")
+    for endpoint, stats in summary['endpoints'].items():
+        print(f"     /{endpoint:<15} {stats['requests']:>6} req  {stats['throughput']:>7.2f} req/s  "
+              f"p50 {stats['p50']} ms  p95 {stats['p95']} ms  p99 {stats['p99']} ms  statuses {stats['statuses']}")
+
+
+async def run(args):
+    url = urlsplit(args.url)
+    host, port = url.hostname or 'localhost', url.port or 80
+
+    server = None
+    if args.spawn:
+        port = free_port()
+        host = '127.0.0.1'
+        server = spawn_server(args.spawn, port)
+        if not await wait_ready(host, port, args.startup_timeout):
+            server.terminate()
+            print("❌ Service did not become ready")
+            return None
+
+    try:
+        if not await check_health(host, port):
+            return None
+
+        images = load_images(args.images, args.sizes)
+        print(f"🖼️  {len(images)} images, {sum(len(data) for _, data in images) / len(images) / 1024:.0f} KB average")
+
+        mode = 'rate' if args.rate else 'concurrency'
+        levels = args.sweep or [args.rate or args.concurrency]
+        workload = Workload(images, args.mix, bust_cache=not args.allow_cache_hits, seed=args.seed)
+        steps = []
+
+        for level in levels:
+            if args.warmup:
+                await run_closed_loop(host, port, workload, 1, args.warmup, args.timeout)
+
+            started = time.perf_counter()
+            if mode == 'rate':
+                results = await run_open_loop(host, port, workload, level, args.duration, args.timeout,
+                                              args.max_connections)
+            else:
+                results = await run_closed_loop(host, port, workload, int(level), args.duration, args.timeout)
+            summary = summarize(results, time.perf_counter() - started)
+
+            print_summary(f"{mode} {level:g}", summary)
+            steps.append({'load': {mode: level}, 'summary': summary})
+
+        report = {'url': f"http://{host}:{port}", 'mix': dict(args.mix), 'duration': args.duration,
+                  'workers': args.spawn, 'steps': steps}
+        if len(steps) > 1:
+            report['saturation'] = find_saturation(steps)
+            if report['saturation']:
+                print(f"🧱 Saturation at {mode} {report['saturation'][mode]:g} ({report['saturation']['reason']})")
+            else:
+                print("📈 No saturation within the tested range")
+        return report
+
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
 
 def main():
-    """Run all tests"""
-    print("🧪 Testing Python MindAR Service")
+    parser = argparse.ArgumentParser(description="Load test the Python MindAR service")
+    parser.add_argument('--url', default='http://localhost:8000', help="Service URL (default: http://localhost:8000)")
+    parser.add_argument('--spawn', type=int, metavar='WORKERS',
+                        help="Start gunicorn app:app locally with this many workers and test it")
+    load = parser.add_mutually_exclusive_group()
+    load.add_argument('--concurrency', type=int, default=4, help="Closed-loop concurrent clients (default: 4)")
+    load.add_argument('--rate', type=float, help="Open-loop arrival rate in requests/second")
+    parser.add_argument('--sweep', type=float, nargs='+', metavar='LEVEL',
+                        help="Run each concurrency (or rate, with --rate) level and report saturation")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per load level (default: 20)")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of warm-up per level (default: 2)")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Weighted endpoint mix (default: {DEFAULT_MIX})")
+    parser.add_argument('--images', nargs='+', help="Image files to replay (default: synthetic corpus)")
+    parser.add_argument('--sizes', nargs='+', default=['2mp', '12mp'],
+                        help="Synthetic corpus sizes when --images is not given (default: 2mp 12mp)")
+    parser.add_argument('--allow-cache-hits', action='store_true',
+                        help="Replay identical bytes so repeated compiles hit the compile cache")
+    parser.add_argument('--max-connections', type=int, default=64, help="Open-loop connection limit (default: 64)")
+    parser.add_argument('--timeout', type=float, default=120, help="Per-request timeout in seconds (default: 120)")
+    parser.add_argument('--startup-timeout', type=float, default=60, help="Seconds to wait for --spawn readiness")
+    parser.add_argument('--seed', type=int, default=0, help="Workload random seed (default: 0)")
+    parser.add_argument('-o', '--output', help="Write the report as JSON")
+    args = parser.parse_args()
+
+    print("🧪 Load testing Python MindAR Service")
     print("=" * 40)
-    
-    # Test health endpoint
-    if not test_health():
-        print("\n❌ Service is not running properly")
-        print("Start the service with: python app.py")
+
+    report = asyncio.run(run(args))
+    if report is None:
         sys.exit(1)
-    
-    print("\n" + "=" * 40)
-    
-    # Test image validation
-    test_image_validation()
-    
-    print("\n" + "=" * 40)
-    
-    # Test mind file generation
-    test_mind_generation()
-    
-    print("\n" + "=" * 40)
-    print("✅ All tests completed!")
-    print("\nNext steps:")
-    print("1. Deploy to Railway/Render/Vercel")
-    print("2. Get your service URL")
-    print("3. Add PYTHON_MINDAR_SERVICE_URL to your Next.js app")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📁 Report saved to {args.output}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
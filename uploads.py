@@ -0,0 +1,144 @@
+"""
+Streaming ingestion of raw image uploads.
+
+Request bodies are read in chunks so we can sniff the format and
+dimensions from the first few KB and reject non-images, too-small or
+too-large uploads before the rest of the body is read or decoded.
+"""
+
+import os
+
+from image_io import read_image_header, sniff_format
+
+# Initial read used for format sniffing; JPEG headers may sit behind a large
+# EXIF/ICC block, so keep reading up to HEADER_SCAN_LIMIT before giving up
+SNIFF_BYTES = 16 * 1024
+HEADER_SCAN_LIMIT = 256 * 1024
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadRejected(Exception):
+    """
+    Upload refused before decoding; carries the HTTP status to answer with
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadLimits:
+    """
+    Size and dimension limits applied to raw image uploads and multipart batches
+    """
+
+    def __init__(self, max_bytes=25 * 1024 * 1024, min_dimension=200, max_dimension=16384,
+                 max_pixels=100 * 1000 * 1000, max_batch_images=20, max_batch_bytes=100 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.min_dimension = min_dimension
+        self.max_dimension = max_dimension
+        self.max_pixels = max_pixels
+        # Batches are buffered in memory whole, so they get their own totals
+        self.max_batch_images = max_batch_images
+        self.max_batch_bytes = max_batch_bytes
+
+    @classmethod
+    def from_env(cls):
+        """
+        Create limits configured from MINDAR_UPLOAD_* environment variables
+        """
+        return cls(
+            max_bytes=int(float(os.environ.get('MINDAR_UPLOAD_MAX_MB', 25)) * 1024 * 1024),
+            min_dimension=int(os.environ.get('MINDAR_UPLOAD_MIN_DIMENSION', 200)),
+            max_dimension=int(os.environ.get('MINDAR_UPLOAD_MAX_DIMENSION', 16384)),
+            max_pixels=int(float(os.environ.get('MINDAR_UPLOAD_MAX_MEGAPIXELS', 100)) * 1000 * 1000),
+            max_batch_images=int(os.environ.get('MINDAR_UPLOAD_MAX_BATCH_IMAGES', 20)),
+            max_batch_bytes=int(float(os.environ.get('MINDAR_UPLOAD_MAX_BATCH_MB', 100)) * 1024 * 1024),
+        )
+
+    def check_header(self, header):
+        """
+        Raise UploadRejected if the (format, width, height) header is out of bounds
+        """
+        _, width, height = header
+
+        if width < self.min_dimension or height < self.min_dimension:
+            raise UploadRejected(
+                f"Image too small ({width}x{height}, need {self.min_dimension}x{self.min_dimension}+)", 422)
+
+        if max(width, height) > self.max_dimension or width * height > self.max_pixels:
+            raise UploadRejected(
+                f"Image too large ({width}x{height}, limit {self.max_dimension}px per side "
+                f"and {self.max_pixels / 1e6:.0f} MP)", 422)
+
+    def check_batch(self, count):
+        """
+        Raise UploadRejected if a batch has more than max_batch_images images
+        """
+        if count > self.max_batch_images:
+            raise UploadRejected(f"Too many images ({count}, limit {self.max_batch_images} per batch)", 413)
+
+    def check_image(self, data):
+        """
+        Sniff and check an already-buffered upload (e.g. a multipart file part)
+        Returns the (format, width, height) header, or None if it could not be parsed
+        """
+        if len(data) > self.max_bytes:
+            raise UploadRejected(f"Upload too large ({len(data)} bytes, limit {self.max_bytes})", 413)
+
+        if sniff_format(data) is None:
+            raise UploadRejected("Unsupported or non-image upload", 415)
+
+        header = read_image_header(data)
+        if header is not None:
+            self.check_header(header)
+        return header
+
+
+def read_image_upload(stream, content_length, limits):
+    """
+    Read a raw image body from a WSGI input stream, rejecting early
+
+    Returns (image_data, header); header is None if the dimensions could not
+    be read from the header (decoding will decide). Raises UploadRejected.
+    """
+    if content_length is not None and content_length > limits.max_bytes:
+        raise UploadRejected(f"Upload too large ({content_length} bytes, limit {limits.max_bytes})", 413)
+
+    buffer = bytearray()
+    header = None
+    sniffed = False
+
+    while True:
+        chunk = stream.read(SNIFF_BYTES if not sniffed else CHUNK_SIZE)
+        if not chunk:
+            break
+
+        buffer += chunk
+        if len(buffer) > limits.max_bytes:
+            raise UploadRejected(f"Upload too large (over {limits.max_bytes} bytes)", 413)
+
+        if not sniffed and len(buffer) >= 32:
+            if sniff_format(buffer) is None:
+                raise UploadRejected("Unsupported or non-image upload", 415)
+            sniffed = True
+
+        if sniffed and header is None and len(buffer) <= HEADER_SCAN_LIMIT:
+            header = read_image_header(buffer)
+            if header is not None:
+                limits.check_header(header)
+
+    if not buffer:
+        raise UploadRejected("No image data provided", 400)
+
+    if not sniffed and sniff_format(buffer) is None:
+        raise UploadRejected("Unsupported or non-image upload", 415)
+
+    if header is None:
+        # Header sits beyond the scan window (large EXIF/ICC block); check before decoding
+        header = read_image_header(buffer)
+        if header is not None:
+            limits.check_header(header)
+
+    # bytearray is returned as-is to avoid copying the body again
+    return buffer, header
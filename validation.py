@@ -0,0 +1,122 @@
+"""
+AR tracking suitability checks shared by the Flask service and the CLI.
+
+validate_gray runs in tiers. The quick tier measures sharpness (int16
+Laplacian at validation resolution) and counts FAST corners on a small
+pyramid level; that decides clearly good or clearly bad images, and only
+borderline ones escalate to the full analysis. The corner thresholds are
+calibrated against ORB, so other detectors always run the full tier.
+
+Sharpness is not taken from the pyramid level itself: pyrDown raises the
+Laplacian variance of blurry photos and lowers it for fine text and UI
+screenshots, so it cannot bound the full-resolution value either way.
+"""
+
+import cv2
+
+from detectors import DEFAULT_DETECTOR, detect_features, get_fast
+
+MIN_FEATURES = 50
+MIN_SHARPNESS = 100
+MIN_DIMENSION = 200
+
+# Longest side of the pyramid level analyzed by the quick tier
+QUICK_LEVEL_SIZE = 256
+
+# FAST corners on the quick level that decide without running ORB.
+# Calibrated on our sample markers: 70+ corners always gave 700+ ORB features.
+CLEAR_FAIL_CORNERS = 5
+CLEAR_PASS_CORNERS = 70
+# Detector the corner thresholds were calibrated against
+QUICK_TIER_DETECTOR = 'orb'
+
+FAST_THRESHOLD = 20
+
+
+def laplacian_variance(gray):
+    """
+    Variance of the Laplacian (sharpness), computed in int16 without a float64 copy
+    """
+    laplacian = cv2.Laplacian(gray, cv2.CV_16S)
+    _, stddev = cv2.meanStdDev(laplacian)
+    return float(stddev[0][0]) ** 2
+
+
+def build_validation_report(feature_count, sharpness, width, height):
+    """
+    Apply the AR tracking suitability criteria to measured image statistics
+    """
+    valid = True
+    issues = []
+
+    if feature_count < MIN_FEATURES:
+        valid = False
+        issues.append(f"Not enough trackable features ({feature_count} found, need {MIN_FEATURES}+)")
+
+    if sharpness < MIN_SHARPNESS:
+        valid = False
+        issues.append(f"Image too blurry (sharpness: {sharpness:.1f})")
+
+    if width < MIN_DIMENSION or height < MIN_DIMENSION:
+        valid = False
+        issues.append(f"Image too small ({width}x{height}, need {MIN_DIMENSION}x{MIN_DIMENSION}+)")
+
+    return {
+        'valid': valid,
+        'featureCount': feature_count,
+        'sharpness': float(sharpness),
+        'dimensions': [width, height],
+        'issues': issues,
+        'recommendation': 'Good for AR tracking' if valid else 'Improve image quality for better tracking'
+    }
+
+
+def quick_level(gray, size=QUICK_LEVEL_SIZE):
+    """
+    Halve with pyrDown until the longest side is at most size
+    """
+    level = gray
+    while max(level.shape[:2]) > size:
+        level = cv2.pyrDown(level)
+    return level
+
+
+def _quick_tier(gray, sharpness, width, height, nfeatures):
+    # Report for a clear decision from FAST corners on a small level, or None when borderline
+    level = quick_level(gray)
+    fast = get_fast(FAST_THRESHOLD)
+    corners = len(fast.detect(level, None))
+    if not (sharpness < MIN_SHARPNESS or corners < CLEAR_FAIL_CORNERS or corners >= CLEAR_PASS_CORNERS):
+        return None
+
+    # Scale the corner count to the analysis resolution, clamped to the decision taken
+    scale = (gray.shape[0] * gray.shape[1]) / (level.shape[0] * level.shape[1])
+    estimate = min(nfeatures, int(corners * scale))
+    if corners < CLEAR_FAIL_CORNERS:
+        estimate = min(estimate, MIN_FEATURES - 1)
+    elif corners >= CLEAR_PASS_CORNERS:
+        estimate = max(estimate, MIN_FEATURES)
+    report = build_validation_report(estimate, sharpness, width, height)
+    return dict(report, featureCountEstimated=True, tier='quick')
+
+
+def validate_gray(gray, width, height, nfeatures=1000, detector=DEFAULT_DETECTOR):
+    """
+    Tiered validation of a grayscale image at validation resolution
+
+    width/height are the original image dimensions; the full tier counts
+    features with the given detector engine, and is the only tier for
+    detectors other than QUICK_TIER_DETECTOR. The report's 'tier'
+    says which stage decided ('quick' or 'full'); quick decisions report a
+    feature count estimated from FAST corners ('featureCountEstimated').
+    """
+    sharpness = laplacian_variance(gray)
+
+    if detector == QUICK_TIER_DETECTOR:
+        report = _quick_tier(gray, sharpness, width, height, nfeatures)
+        if report is not None:
+            return report
+
+    keypoints, _ = detect_features(gray, detector, nfeatures, compute=False)
+    report = build_validation_report(len(keypoints) if keypoints else 0, sharpness, width, height)
+    return dict(report, featureCountEstimated=False, tier='full')
@@ -0,0 +1,223 @@
+"""
+Server-side preparation of AR overlay videos.
+
+Uploaded clips are spooled to disk, then decoded, downscaled and
+re-encoded by a chain of generators: cv2.VideoCapture yields one frame at
+a time, frames above the target rate are dropped, the rest are resized
+into one reused buffer and handed straight to cv2.VideoWriter. Only a
+single frame is in memory at any time, so memory use does not depend on
+the clip's length or size. A poster frame is taken from early in the clip
+along the way, and results are streamed back from disk in chunks.
+
+OpenCV only writes the video track: prepared clips have no audio, which AR
+overlays play muted anyway.
+"""
+
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import buffer_pool
+from uploads import UploadRejected
+
+# Container -> (fourcc, MIME type); which ones work depends on the OpenCV
+# build's FFmpeg (see available_video_formats)
+VIDEO_FORMATS = {
+    'webm': ('VP80', 'video/webm'),
+    'mp4': ('avc1', 'video/mp4'),
+}
+
+CHUNK_SIZE = 256 * 1024
+# Poster frame position as a fraction of the clip (the very first frame is often black)
+POSTER_POSITION = 0.1
+POSTER_QUALITY = 85
+
+
+def _writer_works(video_format):
+    fourcc, _ = VIDEO_FORMATS[video_format]
+    with tempfile.TemporaryDirectory() as directory:
+        writer = cv2.VideoWriter(os.path.join(directory, 'probe.' + video_format),
+                                 cv2.VideoWriter_fourcc(*fourcc), 10, (64, 64))
+        try:
+            if not writer.isOpened():
+                return False
+            writer.write(np.zeros((64, 64, 3), np.uint8))
+            return True
+        finally:
+            writer.release()
+
+
+# Probed once at import so /health and request validation never open an encoder
+_AVAILABLE_FORMATS = tuple(f for f in VIDEO_FORMATS if _writer_works(f))
+
+
+def available_video_formats():
+    """
+    Output formats this OpenCV build can encode
+    """
+    return _AVAILABLE_FORMATS
+
+
+def spool_upload(stream, content_length, directory, max_bytes):
+    """
+    Copy a raw request body to a temporary file in directory, chunk by chunk
+    Returns the file path; raises UploadRejected when empty or over max_bytes
+    """
+    if content_length is not None and content_length > max_bytes:
+        raise UploadRejected(f"Upload too large ({content_length} bytes, limit {max_bytes})", 413)
+
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.upload')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"Upload too large (over {max_bytes} bytes)", 413)
+                f.write(chunk)
+        if not size:
+            raise UploadRejected("No video data provided", 400)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path
+
+
+def probe_video(path):
+    """
+    (width, height, fps, frame_count) of a video file; frame_count is an estimate and may be 0
+    Raises UploadRejected (415) when OpenCV cannot decode the file
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if not capture.isOpened() or not width or not height:
+            raise UploadRejected("Unsupported or non-video upload", 415)
+        return width, height, capture.get(cv2.CAP_PROP_FPS) or 0.0, max(int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+    finally:
+        capture.release()
+
+
+def read_frames(path, timings):
+    """
+    Decoded BGR frames of a video file, one at a time
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        while True:
+            started = time.perf_counter()
+            ok, frame = capture.read()
+            timings['video_decode'] += time.perf_counter() - started
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+def sample_frames(frames, source_fps, max_fps):
+    """
+    Drop frames so that at most max_fps of every source_fps frames are kept
+    """
+    step = source_fps / max_fps if source_fps > max_fps > 0 else 1.0
+    next_kept = 0.0
+    for index, frame in enumerate(frames):
+        if index >= next_kept:
+            next_kept += step
+            yield frame
+
+
+def output_size(width, height, max_size):
+    """
+    Frame size with the longest side at most max_size, rounded to even dimensions for the encoder
+    """
+    scale = min(1.0, max_size / max(width, height))
+    return max(2, round(width * scale / 2) * 2), max(2, round(height * scale / 2) * 2)
+
+
+def downscale_frames(frames, size, timings):
+    """
+    Frames resized to size; each is a pooled buffer, valid until the next one is produced
+    """
+    width, height = size
+    for frame in frames:
+        started = time.perf_counter()
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, size, dst=buffer_pool.take('video', (height, width, 3)),
+                               interpolation=cv2.INTER_AREA)
+        timings['video_resize'] += time.perf_counter() - started
+        yield frame
+
+
+def prepare_video(input_path, output_path, poster_path, max_size=720, max_fps=30, video_format='webm'):
+    """
+    Downscale and re-encode input_path into output_path and write a JPEG poster frame
+    Returns a JSON-serializable summary including per-stage timings in seconds
+    """
+    if video_format not in available_video_formats():
+        raise ValueError(f"Unsupported video format: {video_format}")
+
+    source_width, source_height, source_fps, source_frames = probe_video(input_path)
+    fps = min(source_fps or max_fps, max_fps)
+    size = output_size(source_width, source_height, max_size)
+    poster_index = int(source_frames * POSTER_POSITION * fps / (source_fps or fps))
+
+    fourcc, mimetype = VIDEO_FORMATS[video_format]
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened():
+        raise ValueError(f"Could not open a {video_format} encoder")
+
+    timings = {'video_decode': 0.0, 'video_resize': 0.0, 'video_encode': 0.0}
+    frames = 0
+    try:
+        frames_in = read_frames(input_path, timings)
+        for frame in downscale_frames(sample_frames(frames_in, source_fps, max_fps), size, timings):
+            # First frame as a fallback in case the frame count was overestimated
+            if frames in (0, poster_index):
+                ok, poster = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, POSTER_QUALITY])
+                if ok:
+                    with open(poster_path, 'wb') as f:
+                        f.write(poster.tobytes())
+
+            started = time.perf_counter()
+            writer.write(frame)
+            timings['video_encode'] += time.perf_counter() - started
+            frames += 1
+    finally:
+        writer.release()
+
+    if not frames:
+        raise ValueError("No decodable frames in video")
+
+    return {
+        'width': size[0],
+        'height': size[1],
+        'fps': round(fps, 3),
+        'frames': frames,
+        'durationSeconds': round(frames / fps, 3),
+        'format': video_format,
+        'mimetype': mimetype,
+        'sourceWidth': source_width,
+        'sourceHeight': source_height,
+        'sourceFps': round(source_fps, 3),
+        'timings': {stage: round(seconds, 4) for stage, seconds in timings.items()},
+    }
+
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Contents of a file as chunks of at most chunk_size bytes, for streamed responses
+    """
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk